@@ -4,17 +4,21 @@ import json
 import time
 import datetime
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from TSMApi.session_cache import SessionCache
 
 class TSMApi:
     METHOD_GET = 'GET'
     METHOD_POST = 'POST'
     METHOD_DELETE = 'DELETE'
 
-    def __init__(self, url, port=8850, version=0.5):
-        self.logger = logging.getLogger('TSMApi')
+    def __init__(self, url, port=8850, version=0.5, session_cache=None, timeout=60):
+        self.logger = logging.getLogger('tableau_backup.TSMApi')
         self.server_url = '{}:{}'.format(url, port)
         self.api_version = version
-        self.logger.debug('base_url: "{}", api_version: "{}"'.format(self.server_url, self.api_version))
+        self.session_cache = session_cache
+        self.timeout = timeout
+        self._credentials = None
+        self.logger.debug('base_url: "%s", api_version: "%s"', self.server_url, self.api_version)
         self.session = requests.Session()
         requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -24,28 +28,47 @@ class TSMApi:
             query_string = '?' + '&'.join(params)
         return '{0}/api/{1}/{2}{3}'.format(self.server_url, self.api_version, endpoint, query_string)
 
-    def _requests_wraper(self, url, type=METHOD_GET, data=None, headers={}, json_data=None):
+    def _requests_wraper(self, url, type=METHOD_GET, data=None, headers={}, json_data=None, relogin=True):
         if json:
             headers.update({'content-type': 'application/json'})
             data = json.dumps(json_data)
-        self.logger.debug('{}:"{}", headers: "{}"'.format(type, url, headers))
-        resp = self.session.request(type, url, data=data, headers=headers, verify=False)
+        self.logger.debug('%s:"%s", headers: "%s"', type, url, headers)
+        resp = self.session.request(type, url, data=data, headers=headers, verify=False, timeout=self.timeout)
+        if resp.status_code == 401 and relogin and self._credentials is not None:
+            # Cached or expired session: log in again and retry once.
+            self.logger.debug('401, login again')
+            self._login(*self._credentials)
+            return self._requests_wraper(url, type, data, headers, json_data, relogin=False)
         try:
             resp.raise_for_status()
         except Exception as e:
-            self.logger.error('status code:{}, text:{}'.format(resp.status_code, resp.text))
+            self.logger.error('status code:%s, text:%s', resp.status_code, resp.text)
             raise e
         else:
             if resp.status_code == 200:
-                self.logger.debug('resp json: {}'.format(resp.json()))
-                return resp.json()
+                data = resp.json()
+                # Formatted only if a debug record is actually emitted.
+                self.logger.debug('resp json: %s', data)
+                return data
             else:
                 self.logger.debug('success')
 
-    def login(self, username, password):
+    def _login(self, username, password):
         url = self._build_url(endpoint='login')
         auth = {'authentication': {'name': username, 'password': password}}
-        self._requests_wraper(url, self.METHOD_POST, json_data=auth)
+        self.session.cookies.clear()
+        self._requests_wraper(url, self.METHOD_POST, json_data=auth, relogin=False)
+        if self.session_cache is not None:
+            self.session_cache.store(SessionCache.key(self.server_url, username), self.session.cookies.get_dict())
+
+    def login(self, username, password):
+        self._credentials = (username, password)
+        if self.session_cache is not None:
+            cookies = self.session_cache.load(SessionCache.key(self.server_url, username))
+            if cookies:
+                self.session.cookies.update(cookies)
+                return
+        self._login(username, password)
 
     def start_backup(self, file, add_date=True, skip_verification=False, timeout=1800, override_disk_space_check=False):
         if add_date:
@@ -54,7 +77,7 @@ class TSMApi:
             backup_name = '{0}_{1}'.format(file, date_string)
         else:
             backup_name = file
-        self.logger.debug('Start backup file:{}, skip-verification:{}, timeout:{}, override-disk-space-check: {}'.format(backup_name, skip_verification, timeout, override_disk_space_check))
+        self.logger.debug('Start backup file:%s, skip-verification:%s, timeout:%s, override-disk-space-check: %s', backup_name, skip_verification, timeout, override_disk_space_check)
         backup_params = ['jobTimeoutSeconds={0}'.format(timeout), 'writePath={0}'.format(backup_name), 'overrideDiskSpaceCheck={0}'.format(override_disk_space_check), 'skipVerification={0}'.format(skip_verification)]
         url = self._build_url(endpoint='backupFixedFile', params=backup_params)
         resp = self._requests_wraper(url, self.METHOD_POST)
@@ -71,7 +94,22 @@ class TSMApi:
         resp = self._requests_wraper(url, self.METHOD_GET)
         return resp.get('asyncJob')
 
+    def export_site(self, site_id, file_name=None, timeout=1800):
+        file_name = file_name or site_id
+        self.logger.debug('Export site:%s, file:%s, timeout:%s', site_id, file_name, timeout)
+        export_params = ['jobTimeoutSeconds={0}'.format(timeout), 'fileName={0}'.format(file_name), 'overwrite=true']
+        url = self._build_url(endpoint='sites/{}/export'.format(site_id), params=export_params)
+        resp = self._requests_wraper(url, self.METHOD_POST)
+        return resp.get('asyncJob').get('id')
 
+    def unlock_site(self, site_id):
+        url = self._build_url(endpoint='sites/{}/unlock'.format(site_id))
+        self._requests_wraper(url, self.METHOD_POST)
 
+    def export_settings(self):
+        url = self._build_url(endpoint='export', params=['includeTopology=false'])
+        return self._requests_wraper(url, self.METHOD_GET)
 
-
+    def export_topology(self):
+        url = self._build_url(endpoint='topologies/active')
+        return self._requests_wraper(url, self.METHOD_GET)
@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import logging
+import random
+import time
+
+import aiohttp  # pip install aiohttp
+
+
+class AsyncTSMApi:
+    METHOD_GET = 'GET'
+    METHOD_POST = 'POST'
+    METHOD_DELETE = 'DELETE'
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, url, port=8850, version=0.5, pool_size=10, timeout=60, retries=5, backoff=0.5, max_backoff=30, verify_ssl=False):
+        self.logger = logging.getLogger('tableau_backup.AsyncTSMApi')
+        self.server_url = '{}:{}'.format(url, port)
+        self.api_version = version
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.verify_ssl = verify_ssl
+        self.session = None
+        self._credentials = None
+        self.logger.debug('base_url: "%s", api_version: "%s"', self.server_url, self.api_version)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=None if self.verify_ssl else False)
+            # unsafe: keep the session cookie when the server is addressed by IP.
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, cookie_jar=aiohttp.CookieJar(unsafe=True))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _build_url(self, endpoint, params=None):
+        query_string = ''
+        if params is not None:
+            query_string = '?' + '&'.join(params)
+        return '{0}/api/{1}/{2}{3}'.format(self.server_url, self.api_version, endpoint, query_string)
+
+    def _delay(self, attempt):
+        # Full jitter exponential backoff.
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _requests_wraper(self, url, type=METHOD_GET, json_data=None, relogin=True, idempotent=None):
+        # A POST that reached TSM may already have started a job, so it is only
+        # retried when the connection failed before the request was sent.
+        if idempotent is None:
+            idempotent = type == self.METHOD_GET
+        attempt = 0
+        while True:
+            self.logger.debug('%s:"%s", attempt: %s', type, url, attempt)
+            try:
+                async with self._session().request(type, url, json=json_data) as resp:
+                    if resp.status == 401 and relogin and self._credentials is not None:
+                        self.logger.debug('401, login again')
+                        await self.login(*self._credentials)
+                        relogin = False
+                        continue
+                    if resp.status in self.RETRY_STATUSES and idempotent and attempt < self.retries:
+                        self.logger.debug('status code:%s, retry', resp.status)
+                    else:
+                        if resp.status >= 400:
+                            self.logger.error('status code:%s, text:%s', resp.status, await resp.text())
+                            resp.raise_for_status()
+                        if resp.status == 200:
+                            return await resp.json(content_type=None)
+                        self.logger.debug('success')
+                        return None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise e
+                self.logger.debug('%s: %s, retry', type, e)
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+
+    async def login(self, username, password):
+        self._credentials = (username, password)
+        url = self._build_url(endpoint='login')
+        auth = {'authentication': {'name': username, 'password': password}}
+        await self._requests_wraper(url, self.METHOD_POST, json_data=auth, relogin=False, idempotent=True)
+
+    async def start_backup(self, file, add_date=True, skip_verification=False, timeout=1800, override_disk_space_check=False):
+        if add_date:
+            date_string = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d_%H-%M')
+            backup_name = '{0}_{1}'.format(file, date_string)
+        else:
+            backup_name = file
+        self.logger.debug('Start backup file:%s, skip-verification:%s, timeout:%s, override-disk-space-check: %s', backup_name, skip_verification, timeout, override_disk_space_check)
+        backup_params = ['jobTimeoutSeconds={0}'.format(timeout), 'writePath={0}'.format(backup_name), 'overrideDiskSpaceCheck={0}'.format(override_disk_space_check), 'skipVerification={0}'.format(skip_verification)]
+        url = self._build_url(endpoint='backupFixedFile', params=backup_params)
+        resp = await self._requests_wraper(url, self.METHOD_POST)
+        job_id = resp.get('asyncJob').get('id')
+        return job_id, backup_name
+
+    async def get_jobs(self):
+        url = self._build_url(endpoint='asyncJobs')
+        resp = await self._requests_wraper(url, self.METHOD_GET)
+        return resp.get('asyncJobs')
+
+    async def get_job(self, job_id):
+        url = self._build_url(endpoint='asyncJobs/{}'.format(job_id))
+        resp = await self._requests_wraper(url, self.METHOD_GET)
+        return resp.get('asyncJob')
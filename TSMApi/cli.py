@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import re
+import shlex
+import signal
+
+TABLEAU_PROFILE = '/etc/profile.d/tableau_server.sh'
+# Long progress lines from tsm must not overflow the default 64 KiB reader limit.
+LINE_LIMIT = 1024 * 1024
+
+
+def load_profile_env(path=TABLEAU_PROFILE, base=None):
+    '''Parses the `export NAME=value` lines of the Tableau profile script without running a shell.'''
+    env = dict(os.environ if base is None else base)
+    try:
+        with open(path) as file:
+            lines = file.readlines()
+    except OSError:
+        return env
+    for line in lines:
+        match = re.match(r'\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)$', line)
+        if not match:
+            continue
+        name, value = match.groups()
+        try:
+            value = ''.join(shlex.split(value, comments=True))
+        except ValueError:
+            continue
+        # Expand $VAR and ${VAR} references against what is known so far, e.g. PATH=$PATH:...
+        env[name] = re.sub(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)\}?', lambda m: env.get(m.group(1), ''), value)
+    return env
+
+
+class TSMCommandError(Exception):
+    def __init__(self, argv, returncode, output):
+        self.argv = argv
+        self.returncode = returncode
+        self.output = output
+        super().__init__('{} exited with {}: {}'.format(' '.join(argv), returncode, output[-1] if output else ''))
+
+
+class TSMCli:
+    '''Runs `tsm` commands as subprocesses, a fallback for operations the REST API does not cover.
+
+    Commands are executed from an argv list, never through a shell, and their
+    stdout/stderr are logged line by line as they arrive.
+    '''
+
+    def __init__(self, tsm='tsm', profile=TABLEAU_PROFILE, timeout=3600, concurrency=4, password_stdin=True):
+        self.logger = logging.getLogger('tableau_backup.TSMCli')
+        self.tsm = tsm
+        self.password_stdin = password_stdin
+        self.env = load_profile_env(profile) if profile else dict(os.environ)
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._loop = None
+        self._secrets = set()
+
+    def _redact(self, argv):
+        return ['***' if arg in self._secrets else arg for arg in argv]
+
+    async def _pump(self, stream, level, output):
+        async for line in stream:
+            line = line.decode('utf-8', 'replace').rstrip()
+            if line:
+                output.append(line)
+                self.logger.log(level, line)
+
+    async def run(self, *args, timeout=None, check=True, input=None):
+        '''Runs `tsm <args>`, feeding `input` to stdin, and returns (returncode, output lines).'''
+        argv = [self.tsm] + [str(arg) for arg in args]
+        shown = self._redact(argv)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # The semaphore belongs to one event loop; each asyncio.run gets a fresh one.
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.logger.info('Run "%s"', ' '.join(shown))
+            proc = await asyncio.create_subprocess_exec(*argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+                                                        env=self.env, limit=LINE_LIMIT, start_new_session=True)
+            output = []
+            if input is not None:
+                proc.stdin.write(input.encode())
+                try:
+                    await proc.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                proc.stdin.close()
+            try:
+                await asyncio.wait_for(asyncio.gather(self._pump(proc.stdout, logging.INFO, output),
+                                                      self._pump(proc.stderr, logging.ERROR, output),
+                                                      proc.wait()),
+                                       timeout or self.timeout)
+            except asyncio.TimeoutError:
+                # tsm is a wrapper script; kill its whole process group so no child keeps the pipes open.
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                self.logger.error('"%s" timed out after %ss', ' '.join(shown), timeout or self.timeout)
+                raise TSMCommandError(shown, None, output + ['timed out'])
+        self.logger.debug('"%s" exit code: %s', ' '.join(shown), proc.returncode)
+        if check and proc.returncode != 0:
+            raise TSMCommandError(shown, proc.returncode, output)
+        return proc.returncode, output
+
+    async def run_many(self, commands, timeout=None):
+        '''Runs several argument lists concurrently; failures are returned as exceptions.'''
+        return await asyncio.gather(*(self.run(*args, timeout=timeout) for args in commands), return_exceptions=True)
+
+    async def login(self, username, password):
+        '''Without -p tsm prompts for the password and reads it from stdin.
+
+        That keeps the password out of argv, where any local user could read it
+        through ps or /proc/<pid>/cmdline. password_stdin=False passes -p for tsm
+        builds that only accept it on the command line.
+        '''
+        self._secrets.add(password)
+        if self.password_stdin:
+            return await self.run('login', '-u', username, input=password + '\n')
+        self.logger.warning('Passing the tsm password on the command line, it is visible to local users')
+        return await self.run('login', '-u', username, '-p', password)
+
+    async def status(self, verbose=True):
+        return await self.run('status', '-v') if verbose else await self.run('status')
+
+    async def reconnect(self):
+        return await self.run('jobs', 'reconnect')
+
+    async def export_site(self, site_id, file_name=None, timeout=None):
+        return await self.run('sites', 'export', '-id', site_id, '-f', file_name or site_id, '-ow', timeout=timeout)
+
+    async def unlock_site(self, site_id):
+        return await self.run('sites', 'unlock', '--id', site_id)
+
+    async def export_settings(self, file_name):
+        return await self.run('settings', 'export', '-f', file_name)
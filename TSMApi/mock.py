@@ -0,0 +1,234 @@
+'''Local stand-in for the TSM REST API used for development and benchmarks.
+
+    python -m TSMApi.mock --port 8850 --backup-dir /tmp/backups
+'''
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_STEPS = ['Exporting configuration', 'Backing up repository', 'Backing up file store', 'Verifying backup', 'Writing backup file']
+
+
+class MockJob:
+    def __init__(self, job_id, job_type, steps, step_seconds, fail_step=None, write_path=None, size=0):
+        self.id = str(job_id)
+        self.job_type = job_type
+        self.steps = steps
+        self.step_seconds = step_seconds
+        self.fail_step = fail_step
+        self.write_path = write_path
+        self.size = size
+        self.created = time.time()
+        self._written = False
+
+    def to_json(self):
+        elapsed = time.time() - self.created
+        done_steps = min(len(self.steps), int(elapsed / self.step_seconds))
+        notes = []
+        status = 'Running'
+        for i in range(done_steps):
+            failed = self.fail_step is not None and i == self.fail_step
+            notes.append({'step': self.steps[i], 'status': 'Failed' if failed else 'Succeeded', 'message': self.steps[i],
+                          'timestamp': int((self.created + (i + 1) * self.step_seconds) * 1000)})
+            if failed:
+                status = 'Failed'
+                break
+        if status == 'Running' and done_steps == len(self.steps):
+            status = 'Succeeded'
+            self._write_file()
+        job = {'id': self.id, 'jobType': self.job_type, 'status': status, 'statusMessage': '' if status != 'Failed' else 'Mock failure',
+               'createdAt': int(self.created * 1000), 'progress': 100 * len(notes) // len(self.steps),
+               'detailedProgress': {'progressNotes': notes}}
+        if status != 'Running':
+            job['completedAt'] = notes[-1]['timestamp'] if notes else job['createdAt']
+        return job
+
+    def _write_file(self):
+        if self._written or not self.write_path:
+            return
+        self._written = True
+        with open(self.write_path, 'wb') as file:
+            remaining = self.size
+            while remaining > 0:
+                block = min(remaining, 8 * 1024 * 1024)
+                file.write(os.urandom(block))
+                remaining -= block
+
+
+class MockTSMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, backup_dir=None, step_seconds=1.0, steps=None, latency=0.0, failure_rate=0.0,
+                 fail_step=None, backup_size=1024 * 1024, username='tadmin', password='tadmin'):
+        super().__init__(('127.0.0.1', port), MockTSMHandler)
+        self.backup_dir = backup_dir
+        self.step_seconds = step_seconds
+        self.steps = steps or DEFAULT_STEPS
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_step = fail_step
+        self.backup_size = backup_size
+        self.credentials = (username, password)
+        self.jobs = {}
+        self.requests = 0
+        self.hits = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.session = 'mock-session-1'
+        self.faults = deque()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}'.format(self.server_address[0])
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_job(self, job_type, write_name=None):
+        with self._lock:
+            job_id = next(self._ids)
+        write_path = os.path.join(self.backup_dir, write_name) if self.backup_dir and write_name else None
+        job = MockJob(job_id, job_type, self.steps, self.step_seconds, self.fail_step, write_path, self.backup_size)
+        self.jobs[job.id] = job
+        return job
+
+    def inject(self, *faults):
+        '''Queues faults for the next requests: an HTTP status code, or 'reset' to drop the connection.'''
+        self.faults.extend(faults)
+
+    def expire_sessions(self):
+        '''Invalidates every session cookie handed out so far.'''
+        with self._lock:
+            number = int(self.session.rsplit('-', 1)[1]) + 1
+            self.session = 'mock-session-{}'.format(number)
+
+    def start_background(self):
+        thread = threading.Thread(target=self.serve_forever, name='mock-tsm', daemon=True)
+        thread.start()
+        return self
+
+
+class MockTSMHandler(BaseHTTPRequestHandler):
+    SESSION_COOKIE = 'AUTH_COOKIE'
+
+    def log_message(self, format, *args):
+        logging.getLogger('tableau_backup.MockTSMServer').debug(format % args)
+
+    def _reply(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _route(self, method):
+        server = self.server
+        with server._lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self._handle(method)
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+    def _handle(self, method):
+        server = self.server
+        server.requests += 1
+        server.hits[(method, urlparse(self.path).path)] += 1
+        try:
+            fault = server.faults.popleft()
+        except IndexError:
+            fault = None
+        if fault == 'reset':
+            # Drop the connection without an answer, as a crashed gateway would.
+            self.close_connection = True
+            return
+        if fault is not None:
+            return self._reply(fault, {'error': 'injected fault'})
+        if server.latency:
+            time.sleep(server.latency)
+        if server.failure_rate and random.random() < server.failure_rate:
+            return self._reply(503, {'error': 'injected failure'})
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) < 3 or parts[0] != 'api':
+            return self._reply(404, {'error': 'not found'})
+        endpoint = parts[2:]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = {}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length) or b'null') or {}
+            except ValueError:
+                body = {}
+        if endpoint == ['login'] and method == 'POST':
+            auth = body.get('authentication', {})
+            if (auth.get('name'), auth.get('password')) != server.credentials:
+                return self._reply(401, {'error': 'bad credentials'})
+            return self._reply(204, headers={'Set-Cookie': '{}={}; Path=/'.format(self.SESSION_COOKIE, server.session)})
+        if '{}={}'.format(self.SESSION_COOKIE, server.session) not in (self.headers.get('Cookie') or ''):
+            return self._reply(401, {'error': 'not logged in'})
+        if endpoint == ['backupFixedFile'] and method == 'POST':
+            job = server.add_job('BackupFixedFileJob', params.get('writePath'))
+            return self._reply(200, {'asyncJob': job.to_json()})
+        if endpoint[0] == 'sites' and len(endpoint) == 3 and method == 'POST':
+            if endpoint[2] == 'export':
+                job = server.add_job('SiteExportJob', params.get('fileName'))
+                return self._reply(200, {'asyncJob': job.to_json()})
+            if endpoint[2] == 'unlock':
+                return self._reply(204)
+        if endpoint == ['export'] and method == 'GET':
+            return self._reply(200, {'configKeys': {'mock.setting': 'value'}, 'configEntities': {}})
+        if endpoint == ['topologies', 'active'] and method == 'GET':
+            return self._reply(200, {'nodes': {'node1': {'services': {}}}})
+        if endpoint == ['asyncJobs'] and method == 'GET':
+            return self._reply(200, {'asyncJobs': [job.to_json() for job in server.jobs.values()]})
+        if endpoint[0] == 'asyncJobs' and len(endpoint) == 2 and method == 'GET':
+            job = server.jobs.get(endpoint[1])
+            if job is None:
+                return self._reply(404, {'error': 'no such job'})
+            return self._reply(200, {'asyncJob': job.to_json()})
+        return self._reply(404, {'error': 'not found'})
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock TSM REST API server')
+    parser.add_argument('--port', type=int, default=8850)
+    parser.add_argument('--backup-dir', default=None)
+    parser.add_argument('--step-seconds', type=float, default=1.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--fail-step', type=int, default=None)
+    parser.add_argument('--backup-size', type=int, default=1024 * 1024)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    server = MockTSMServer(port=args.port, backup_dir=args.backup_dir, step_seconds=args.step_seconds, latency=args.latency,
+                           failure_rate=args.failure_rate, fail_step=args.fail_step, backup_size=args.backup_size)
+    print('Mock TSM listening on {}:{}'.format(server.url, server.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
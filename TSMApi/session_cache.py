@@ -0,0 +1,83 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+class SessionCache:
+    '''TSM session cookies shared between processes through a 0600 JSON file.'''
+
+    def __init__(self, path, ttl=1800):
+        self.logger = logging.getLogger('tableau_backup.SessionCache')
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # The cookies are credentials: keep them out of world-writable directories.
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def key(server_url, username):
+        return '{}|{}'.format(server_url, username)
+
+    def _lock(self, mode):
+        # O_NOFOLLOW: never open a planted symlink in place of the lock file.
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        fcntl.flock(fd, mode)
+        return fd
+
+    def _unlock(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _read(self):
+        try:
+            with os.fdopen(os.open(self.path, os.O_RDONLY | os.O_NOFOLLOW)) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, key):
+        fd = self._lock(fcntl.LOCK_SH)
+        try:
+            entry = self._read().get(key)
+        finally:
+            self._unlock(fd)
+        if entry and entry.get('expires', 0) > time.time():
+            self.hits += 1
+            self.logger.debug('session cache hit, hits: %s, misses: %s', self.hits, self.misses)
+            return entry['cookies']
+        self.misses += 1
+        self.logger.debug('session cache miss, hits: %s, misses: %s', self.hits, self.misses)
+        return None
+
+    def _update(self, key, entry):
+        fd = self._lock(fcntl.LOCK_EX)
+        try:
+            sessions = self._read()
+            now = time.time()
+            sessions = {k: v for k, v in sessions.items() if v.get('expires', 0) > now}
+            if entry is None:
+                sessions.pop(key, None)
+            else:
+                sessions[key] = entry
+            # mkstemp creates a new 0600 file with O_EXCL, so a pre-planted name cannot redirect the write.
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                                prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(tmp_fd, 'w') as json_file:
+                    json.dump(sessions, json_file)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        finally:
+            self._unlock(fd)
+
+    def store(self, key, cookies):
+        self._update(key, {'cookies': cookies, 'expires': time.time() + self.ttl})
+
+    def invalidate(self, key):
+        self._update(key, None)
@@ -0,0 +1,66 @@
+import logging
+import os
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _check_members(path, names, block_size):
+    results = []
+    with zipfile.ZipFile(path) as archive:
+        for name in names:
+            info = archive.getinfo(name)
+            crc = 0
+            size = 0
+            error = None
+            try:
+                with archive.open(info) as member:
+                    while True:
+                        data = member.read(block_size)
+                        if not data:
+                            break
+                        crc = zlib.crc32(data, crc)
+                        size += len(data)
+                if crc != info.CRC or size != info.file_size:
+                    error = 'crc {:08x} != {:08x} or size {} != {}'.format(crc, info.CRC, size, info.file_size)
+            except (zipfile.BadZipFile, zlib.error, EOFError, OSError, NotImplementedError) as e:
+                error = str(e)
+            results.append((name, size, error))
+    return results
+
+
+class ArchiveVerifier:
+    '''Checks member CRCs of a .tsbak (zip) container by streaming, without extracting to disk.'''
+
+    def __init__(self, workers=None, block_size=4 * 1024 * 1024):
+        self._logger = logging.getLogger('tableau_backup.ArchiveVerifier')
+        self.workers = workers or os.cpu_count() or 1
+        self.block_size = block_size
+
+    def _buckets(self, infos):
+        # Largest members first, each to the least loaded worker.
+        buckets = [[0, []] for _ in range(min(self.workers, max(len(infos), 1)))]
+        for info in sorted(infos, key=lambda i: i.compress_size, reverse=True):
+            bucket = min(buckets, key=lambda b: b[0])
+            bucket[0] += info.compress_size
+            bucket[1].append(info.filename)
+        return [names for _, names in buckets if names]
+
+    def verify(self, path):
+        started = time.time()
+        with zipfile.ZipFile(path) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+        self._logger.debug('Verify {}: {} members with {} workers'.format(path, len(infos), self.workers))
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(_check_members, path, names, self.block_size) for names in self._buckets(infos)]
+            results = [result for f in futures for result in f.result()]
+        seconds = max(time.time() - started, 1e-9)
+        compressed = os.path.getsize(path)
+        return {
+            'members': len(results),
+            'corrupt': [(name, error) for name, _, error in results if error],
+            'bytes': sum(size for _, size, _ in results),
+            'seconds': seconds,
+            'mb_per_sec': compressed / seconds / 1024 / 1024,
+        }
@@ -0,0 +1,82 @@
+import logging
+import shutil
+import time
+
+ADMISSION_MODES = ('refuse', 'prune', 'proceed')
+
+
+class SizeForecast:
+    '''Predicts the next backup size from (timestamp, size) samples with a least-squares trend.'''
+
+    def __init__(self, samples, window=10):
+        self.samples = sorted(samples)[-window:]
+
+    def growth_per_day(self):
+        if len(self.samples) < 2:
+            return 0.0
+        n = len(self.samples)
+        mean_t = sum(t for t, _ in self.samples) / n
+        mean_s = sum(s for _, s in self.samples) / n
+        var = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        if not var:
+            return 0.0
+        slope = sum((t - mean_t) * (s - mean_s) for t, s in self.samples) / var
+        return slope * 86400
+
+    def predict(self, at=None):
+        if not self.samples:
+            return 0
+        at = time.time() if at is None else at
+        latest_t, latest_s = self.samples[-1]
+        trend = latest_s + self.growth_per_day() * (at - latest_t) / 86400
+        # A shrinking trend never forecasts below the latest backup.
+        return int(max(trend, latest_s))
+
+
+class AdmissionControl:
+    '''Decides whether a backup of the forecast size fits in the backup dir.'''
+
+    def __init__(self, backup_dir, mode='refuse', margin=0.1, min_margin_bytes=0):
+        if mode not in ADMISSION_MODES:
+            raise ValueError('Unknown admission mode: {}'.format(mode))
+        self._logger = logging.getLogger('tableau_backup.AdmissionControl')
+        self.backup_dir = backup_dir
+        self.mode = mode
+        self.margin = margin
+        self.min_margin_bytes = min_margin_bytes
+
+    @classmethod
+    def from_config(cls, backup_dir, conf):
+        return cls(backup_dir, conf.get('mode', 'refuse'), float(conf.get('margin', 0.1)), int(conf.get('min_margin_bytes', 0)))
+
+    def required_bytes(self, forecast):
+        return forecast + max(int(forecast * self.margin), self.min_margin_bytes)
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.backup_dir).free
+
+    def admit(self, forecast, policy=None, inventory=None, metrics=None):
+        '''Returns True if the backup may start, pruning with the retention policy in prune mode.
+
+        Without a policy (retention disabled) prune mode refuses like refuse mode.
+        '''
+        required = self.required_bytes(forecast)
+        free = self.free_bytes()
+        if free < required and self.mode == 'prune' and policy is not None:
+            pruned = policy.apply(inventory, required_bytes=required, free_bytes=free)
+            self._logger.info('Pruned {} backups, {} bytes to make room'.format(len(pruned), sum(b.size for b in pruned)))
+            free = self.free_bytes()
+        if metrics is not None:
+            metrics.set('admission.forecast_bytes', forecast)
+            metrics.set('admission.required_bytes', required)
+            metrics.set('admission.free_bytes', free)
+            metrics.set('admission.margin_bytes', required - forecast)
+            metrics.set('admission.headroom_bytes', free - required)
+        if free >= required:
+            self._logger.debug('Admit backup: forecast {} bytes, {} free'.format(forecast, free))
+            return True
+        if self.mode == 'proceed':
+            self._logger.warning('Backup may not fit: forecast {} bytes with margin, {} free'.format(required, free))
+            return True
+        self._logger.error('Refuse backup: forecast {} bytes with margin, only {} free in {}'.format(required, free, self.backup_dir))
+        return False
@@ -0,0 +1,131 @@
+import logging
+import sqlite3
+import time
+
+FINAL_STATUSES = ('Succeeded', 'Failed', 'Cancelled')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job_type TEXT,
+    backup_name TEXT,
+    file_size INTEGER,
+    sha256 TEXT,
+    status TEXT,
+    status_message TEXT,
+    created_at REAL,
+    completed_at REAL,
+    duration REAL,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS steps (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    step TEXT,
+    status TEXT,
+    message TEXT,
+    timestamp REAL,
+    duration REAL,
+    PRIMARY KEY (job_id, seq)
+);
+'''
+
+
+def _seconds(value):
+    '''TSM reports epoch timestamps in milliseconds.'''
+    if value is None:
+        return None
+    value = float(value)
+    return value / 1000 if value > 1e11 else value
+
+
+class Catalog:
+    def __init__(self, path):
+        self._logger = logging.getLogger('tableau_backup.Catalog')
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record_start(self, job_id, backup_name, job_type='BackupFixedFileJob'):
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO jobs (id, job_type, backup_name, status, created_at, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                            (str(job_id), job_type, backup_name, 'Created', time.time(), time.time()))
+
+    def record_file(self, job_id, file_size, sha256):
+        with self.db:
+            self.db.execute('UPDATE jobs SET file_size = ?, sha256 = ?, updated = ? WHERE id = ?',
+                            (file_size, sha256, time.time(), str(job_id)))
+
+    def record_job(self, job):
+        '''Upserts a TSM asyncJob and its progress notes, keeping locally recorded fields.'''
+        job_id = str(job['id'])
+        created = _seconds(job.get('createdAt'))
+        completed = _seconds(job.get('completedAt')) if job.get('status') in FINAL_STATUSES else None
+        duration = completed - created if completed and created else None
+        notes = (job.get('detailedProgress') or {}).get('progressNotes') or []
+        steps = []
+        previous = created
+        for seq, note in enumerate(notes):
+            timestamp = _seconds(note.get('timestamp'))
+            steps.append((job_id, seq, note.get('step'), note.get('status'), note.get('message'), timestamp,
+                          timestamp - previous if timestamp and previous else None))
+            previous = timestamp
+        with self.db:
+            self.db.execute('''INSERT INTO jobs (id, job_type, status, status_message, created_at, completed_at, duration, updated)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT(id) DO UPDATE SET job_type = COALESCE(excluded.job_type, job_type), status = excluded.status,
+                               status_message = excluded.status_message, created_at = COALESCE(excluded.created_at, created_at),
+                               completed_at = excluded.completed_at, duration = excluded.duration, updated = excluded.updated''',
+                            (job_id, job.get('jobType'), job.get('status'), job.get('statusMessage'), created, completed, duration, time.time()))
+            self.db.execute('DELETE FROM steps WHERE job_id = ?', (job_id,))
+            self.db.executemany('INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?)', steps)
+
+    def final_ids(self):
+        placeholders = ','.join('?' * len(FINAL_STATUSES))
+        rows = self.db.execute('SELECT id FROM jobs WHERE status IN ({})'.format(placeholders), FINAL_STATUSES)
+        return {row['id'] for row in rows}
+
+    def sync(self, tsm):
+        '''Records jobs from TSMApi.get_jobs, fetching details only for jobs not yet known as finished.'''
+        final_ids = self.final_ids()
+        synced = 0
+        for job in tsm.get_jobs() or []:
+            if str(job['id']) in final_ids:
+                continue
+            if 'detailedProgress' not in job:
+                job = tsm.get_job(job_id=job['id'])
+            self.record_job(job)
+            synced += 1
+        self._logger.debug('Synced {} jobs, skipped {} finished'.format(synced, len(final_ids)))
+        return synced
+
+    def jobs(self, limit=50, job_type=None):
+        query = 'SELECT * FROM jobs'
+        args = ()
+        if job_type:
+            query += ' WHERE job_type = ?'
+            args = (job_type,)
+        return self.db.execute(query + ' ORDER BY created_at DESC LIMIT ?', args + (limit,)).fetchall()
+
+    def job(self, job_id):
+        return self.db.execute('SELECT * FROM jobs WHERE id = ?', (str(job_id),)).fetchone()
+
+    def latest(self):
+        return self.db.execute("""SELECT * FROM jobs WHERE backup_name IS NOT NULL OR job_type LIKE '%Backup%'
+                                  ORDER BY created_at DESC LIMIT 1""").fetchone()
+
+    def size_history(self, limit=10):
+        '''(created_at, file_size) of the latest successful backups, oldest first.'''
+        rows = self.db.execute("""SELECT created_at, file_size FROM jobs WHERE status = 'Succeeded' AND file_size IS NOT NULL
+                                  AND job_type LIKE '%Backup%' ORDER BY created_at DESC LIMIT ?""", (limit,)).fetchall()
+        return [(row['created_at'], row['file_size']) for row in reversed(rows)]
+
+    def steps(self, job_id):
+        return self.db.execute('SELECT * FROM steps WHERE job_id = ? ORDER BY seq', (str(job_id),)).fetchall()
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from TableauBackup.throttle import TokenBucket
+
+MANIFEST_SUFFIX = '.manifest.json'
+SIDECAR_SUFFIX = '.sha256'
+
+
+def _hash_range(path, offset, length, block_size, mb_per_sec=None):
+    limiter = TokenBucket(mb_per_sec) if mb_per_sec else None
+    sha256_hash = hashlib.sha256()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        position = offset
+        end = offset + length
+        while position < end:
+            data = os.pread(fd, min(block_size, end - position), position)
+            if not data:
+                break
+            if limiter is not None:
+                limiter.consume(len(data))
+            sha256_hash.update(data)
+            position += len(data)
+    finally:
+        os.close(fd)
+    return sha256_hash.hexdigest()
+
+
+class ChunkDigests:
+    '''Per-chunk SHA-256 of a stream fed in pieces of any size, for a manifest built alongside another pass.'''
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.digests = []
+        self._hash = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        # A piece can end inside a chunk or span a chunk boundary.
+        while view:
+            take = min(len(view), self.chunk_size - self._filled)
+            self._hash.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.chunk_size:
+                self.digests.append(self._hash.hexdigest())
+                self._hash, self._filled = hashlib.sha256(), 0
+
+    def finish(self):
+        if self._filled:
+            self.digests.append(self._hash.hexdigest())
+            self._hash, self._filled = hashlib.sha256(), 0
+        return self.digests
+
+
+class Sha256Engine:
+    def __init__(self, block_size=8 * 1024 * 1024, chunk_size=256 * 1024 * 1024, workers=None, limiter=None):
+        self._logger = logging.getLogger('tableau_backup.Sha256Engine')
+        self.limiter = limiter
+        self.block_size = block_size
+        # Chunk boundaries fall on block boundaries, so a single read pass can also feed the chunk hashes.
+        self.chunk_size = max(block_size, chunk_size // block_size * block_size)
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sha256')
+
+    def _scan(self, path, chunked=False):
+        '''Reads path once in a background thread. Returns the SHA-256 and, if chunked, the per-chunk digests.
+
+        The whole-file hash runs in the calling thread and the chunk hashes in a
+        second one; hashlib releases the GIL, so both proceed in parallel on the
+        same buffers instead of reading the file twice.
+        '''
+        queues = [queue.Queue(maxsize=2) for _ in range(2 if chunked else 1)]
+        free = queue.Queue()
+        for _ in range(len(queues) + 2):
+            free.put(bytearray(self.block_size))
+        users = {}
+        lock = threading.Lock()
+        errors = []
+        chunks = []
+
+        def release(buf):
+            with lock:
+                users[id(buf)] -= 1
+                done = not users[id(buf)]
+            if done:
+                free.put(buf)
+
+        def reader():
+            try:
+                with open(path, 'rb', buffering=0) as file:
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    while True:
+                        buf = free.get()
+                        size = file.readinto(buf)
+                        if not size:
+                            break
+                        if self.limiter is not None:
+                            self.limiter.consume(size)
+                        with lock:
+                            users[id(buf)] = len(queues)
+                        for q in queues:
+                            q.put((buf, size))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for q in queues:
+                    q.put(None)
+
+        def chunk_hasher():
+            digests = self.chunk_digests()
+            while True:
+                item = queues[1].get()
+                if item is None:
+                    break
+                buf, size = item
+                digests.update(memoryview(buf)[:size])
+                release(buf)
+            chunks.extend(digests.finish())
+
+        threads = [threading.Thread(target=reader, name='sha256-reader', daemon=True)]
+        if chunked:
+            threads.append(threading.Thread(target=chunk_hasher, name='sha256-chunks', daemon=True))
+        for thread in threads:
+            thread.start()
+        sha256_hash = hashlib.sha256()
+        while True:
+            item = queues[0].get()
+            if item is None:
+                break
+            buf, size = item
+            sha256_hash.update(memoryview(buf)[:size])
+            release(buf)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return sha256_hash.hexdigest(), chunks
+
+    def file_digest(self, path):
+        '''Reads the file in a background thread and hashes it in the calling one.'''
+        return self._scan(path)[0]
+
+    def digest_with_manifest(self, path):
+        '''Returns the SHA-256 and the chunked manifest of path from a single read pass.'''
+        size = os.path.getsize(path)
+        self._logger.debug('Hash {} and build its manifest in one pass'.format(path))
+        sha256sum, chunks = self._scan(path, chunked=True)
+        return sha256sum, self._manifest(path, size, chunks)
+
+    def chunk_digests(self):
+        '''Returns a ChunkDigests to feed from another read pass of a file, see manifest_from.'''
+        return ChunkDigests(self.chunk_size)
+
+    def manifest_from(self, path, chunk_digests):
+        '''Builds the manifest of path from a ChunkDigests fed with all of its bytes.'''
+        return self._manifest(path, os.path.getsize(path), chunk_digests.finish())
+
+    def submit(self, path):
+        '''Returns a future with the SHA-256 of path, computed off the main thread.'''
+        self._logger.debug('Hash {} with block_size: {}'.format(path, self.block_size))
+        return self._executor.submit(self.file_digest, path)
+
+    def _ranges(self, size):
+        return [(offset, min(self.chunk_size, size - offset)) for offset in range(0, size, self.chunk_size)]
+
+    def _hash_chunks(self, path, ranges):
+        # Worker processes cannot share the bucket, each gets an equal share of the rate.
+        mb_per_sec = self.limiter.share(self.workers) if self.limiter is not None else None
+        digests = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [(length, pool.submit(_hash_range, path, offset, length, self.block_size, mb_per_sec)) for offset, length in ranges]
+            for length, future in futures:
+                digests.append(future.result())
+                if self.limiter is not None:
+                    self.limiter.record(length)
+        return digests
+
+    def manifest(self, path):
+        '''Builds a chunked manifest: per-chunk SHA-256 plus a root hash over the chunk digests.'''
+        size = os.path.getsize(path)
+        self._logger.debug('Build manifest for {} ({} bytes) with {} workers'.format(path, size, self.workers))
+        return self._manifest(path, size, self._hash_chunks(path, self._ranges(size)))
+
+    def _manifest(self, path, size, chunks):
+        return {
+            'file': os.path.basename(path),
+            'size': size,
+            'algorithm': 'sha256',
+            'chunk_size': self.chunk_size,
+            'chunks': chunks,
+            'root': self.root_hash(chunks),
+        }
+
+    @staticmethod
+    def root_hash(chunks):
+        return hashlib.sha256(b''.join(bytes.fromhex(c) for c in chunks)).hexdigest()
+
+    def write_manifest(self, path, manifest):
+        manifest_path = path + MANIFEST_SUFFIX
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        return manifest_path
+
+    def verify_manifest(self, manifest_path):
+        '''Returns the list of chunk indexes that do not match the manifest.'''
+        with open(manifest_path) as json_file:
+            manifest = json.load(json_file)
+        path = os.path.join(os.path.dirname(manifest_path), manifest['file'])
+        size = os.path.getsize(path)
+        if size != manifest['size']:
+            raise ValueError('{}: size {} does not match manifest size {}'.format(path, size, manifest['size']))
+        if self.root_hash(manifest['chunks']) != manifest['root']:
+            raise ValueError('{}: manifest root hash is inconsistent'.format(manifest_path))
+        chunk_size = manifest['chunk_size']
+        ranges = [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+        chunks = self._hash_chunks(path, ranges)
+        return [i for i, (actual, expected) in enumerate(zip(chunks, manifest['chunks'])) if actual != expected]
+
+    @staticmethod
+    def write_sidecar(path, sha256sum):
+        sidecar_path = path + SIDECAR_SUFFIX
+        with open(sidecar_path, 'w') as file:
+            file.write(sha256sum)
+        return sidecar_path
+
+    @staticmethod
+    def read_sidecar(path):
+        with open(path + SIDECAR_SUFFIX) as file:
+            return file.read().split()[0]
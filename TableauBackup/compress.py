@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import os
+import time
+
+try:
+    import zstandard  # pip install zstandard
+except ImportError:
+    zstandard = None
+
+from TableauBackup.checksum import Sha256Engine
+
+ARCHIVE_SUFFIX = '.zst'
+
+
+class StreamCompressor:
+    def __init__(self, level=3, threads=0, block_size=8 * 1024 * 1024, limiter=None):
+        if zstandard is None:
+            raise RuntimeError('Compression requires the zstandard package (pip install zstandard)')
+        self._logger = logging.getLogger('tableau_backup.StreamCompressor')
+        self.level = level
+        self.threads = threads if threads else os.cpu_count() or 1
+        self.block_size = block_size
+        self.limiter = limiter
+
+    @staticmethod
+    def _stats(bytes_in, bytes_out, started, sha256sum):
+        seconds = max(time.time() - started, 1e-9)
+        return {
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'seconds': seconds,
+            'ratio': bytes_in / max(bytes_out, 1),
+            'mb_per_sec': bytes_in / seconds / 1024 / 1024,
+            'sha256': sha256sum,
+        }
+
+    def compress_file(self, src, archive_dir, chunk_digests=None):
+        '''Compresses src into archive_dir, hashing the input in the same read pass.
+
+        chunk_digests (a checksum.ChunkDigests) is fed the input too, for a manifest.
+        '''
+        os.makedirs(archive_dir, exist_ok=True)
+        dst = os.path.join(archive_dir, os.path.basename(src) + ARCHIVE_SUFFIX)
+        tmp_dst = dst + '.tmp'
+        self._logger.debug('Compress {} to {}, level: {}, threads: {}'.format(src, dst, self.level, self.threads))
+        started = time.time()
+        sha256_hash = hashlib.sha256()
+        bytes_in = 0
+        buf = bytearray(self.block_size)
+        view = memoryview(buf)
+        cctx = zstandard.ZstdCompressor(level=self.level, threads=self.threads, write_content_size=False)
+        with open(src, 'rb', buffering=0) as in_file, open(tmp_dst, 'wb') as out_file:
+            with cctx.stream_writer(out_file, closefd=False) as writer:
+                while True:
+                    size = in_file.readinto(buf)
+                    if not size:
+                        break
+                    if self.limiter is not None:
+                        self.limiter.consume(size)
+                    sha256_hash.update(view[:size])
+                    if chunk_digests is not None:
+                        chunk_digests.update(view[:size])
+                    writer.write(view[:size])
+                    bytes_in += size
+        os.replace(tmp_dst, dst)
+        sha256sum = sha256_hash.hexdigest()
+        Sha256Engine.write_sidecar(os.path.join(archive_dir, os.path.basename(src)), sha256sum)
+        stats = self._stats(bytes_in, os.path.getsize(dst), started, sha256sum)
+        stats['path'] = dst
+        return stats
+
+    def decompress_file(self, src, dst):
+        '''Streams src back to dst and checks it against the archived .sha256 sidecar if present.'''
+        self._logger.debug('Decompress {} to {}'.format(src, dst))
+        started = time.time()
+        sha256_hash = hashlib.sha256()
+        bytes_out = 0
+        dctx = zstandard.ZstdDecompressor()
+        with open(src, 'rb') as in_file, open(dst, 'wb') as out_file:
+            with dctx.stream_reader(in_file) as reader:
+                while True:
+                    data = reader.read(self.block_size)
+                    if not data:
+                        break
+                    if self.limiter is not None:
+                        self.limiter.consume(len(data))
+                    sha256_hash.update(data)
+                    out_file.write(data)
+                    bytes_out += len(data)
+        sha256sum = sha256_hash.hexdigest()
+        base = src[:-len(ARCHIVE_SUFFIX)] if src.endswith(ARCHIVE_SUFFIX) else src
+        if os.path.exists(base + '.sha256') and Sha256Engine.read_sidecar(base) != sha256sum:
+            raise ValueError('{}: sha256 {} does not match {}.sha256'.format(dst, sha256sum, base))
+        return self._stats(os.path.getsize(src), bytes_out, started, sha256sum)
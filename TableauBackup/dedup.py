@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from TableauBackup.throttle import TokenBucket
+
+try:
+    from fastcdc.fastcdc_cy import fastcdc_cy  # pip install fastcdc
+except ImportError:
+    fastcdc_cy = None
+
+MASK64 = (1 << 64) - 1
+# Fixed seed: the gear table must never change, otherwise chunk boundaries
+# (and with them every stored chunk) would stop matching between runs.
+_rng = random.Random(0x7461626c)
+GEAR = [_rng.getrandbits(64) for _ in range(256)]
+# Size limits asserted by fastcdc.
+FASTCDC_MIN_SIZE, FASTCDC_AVG_SIZE, FASTCDC_MAX_SIZE = 64, 256, 1024
+
+
+def _cut_points(data, min_size, avg_size, max_size, chunker='gear'):
+    '''Returns chunk end offsets.
+
+    fastcdc is the native (Cython) FastCDC scan at several hundred MB/s per core.
+    The gear scan is pure Python and manages only a few MB/s per core, so
+    chunking a large backup with it takes hours even with every core busy (see
+    the dedup benchmark). The two place cut points differently.
+    '''
+    if chunker == 'fastcdc':
+        return [chunk.offset + chunk.length for chunk in fastcdc_cy(data, min_size, avg_size, max_size)]
+    return _gear_cut_points(data, min_size, avg_size, max_size)
+
+
+def _gear_cut_points(data, min_size, avg_size, max_size):
+    '''Gear rolling hash content-defined chunking, returns chunk end offsets.'''
+    mask = (1 << max(1, avg_size.bit_length() - 1)) - 1
+    mask <<= 64 - mask.bit_length()
+    gear = GEAR
+    cuts = []
+    start = 0
+    length = len(data)
+    while start < length:
+        end = min(start + max_size, length)
+        if end - start <= min_size:
+            cuts.append(end)
+            break
+        # The gear hash only depends on the last 64 bytes, so nothing before
+        # min_size - 64 can influence a cut and it is skipped.
+        h = 0
+        i = start + max(0, min_size - 64)
+        cut = end
+        for i in range(i, end):
+            h = ((h << 1) + gear[data[i]]) & MASK64
+            if h & mask == 0 and i + 1 - start >= min_size:
+                cut = i + 1
+                break
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def _segment_cuts(file, offset, length, size, min_size, avg_size, max_size, chunker):
+    '''Reads the segment at offset and returns (data, cuts, end), cuts being absolute chunk end offsets.
+
+    Segments are chunked in parallel, each from its own start, so a fixed
+    segment edge would be a forced cut that an insertion shifts in every later
+    segment. Instead the chunking carries on past the edge until it meets a cut
+    the next segment makes from its own start: from there on both agree, so
+    end is that cut and the next segment's chunks before it are dropped. Without
+    a meeting point within 4 * max_size, end is the segment edge.
+    '''
+    file.seek(offset)
+    data = bytearray(file.read(length))
+    edge = offset + length
+    if edge >= size:
+        return data, [offset + c for c in _cut_points(data, min_size, avg_size, max_size, chunker)], size
+    cuts = [offset + c for c in _cut_points(data, min_size, avg_size, max_size, chunker)[:-1]]
+    last = cuts[-1] if cuts else offset
+    while True:
+        data += file.read(max(avg_size, len(data) - length))
+        at_eof = offset + len(data) >= size
+        with memoryview(data) as view:
+            ours = [last + c for c in _cut_points(view[last - offset:], min_size, avg_size, max_size, chunker)]
+            theirs = set(edge + c for c in _cut_points(view[length:], min_size, avg_size, max_size, chunker))
+        if not at_eof:
+            # The buffer end is not a real cut yet.
+            ours.pop()
+        common = [c for c in ours if c in theirs]
+        if common:
+            return data, cuts + [c for c in ours if c <= common[0]], common[0]
+        if at_eof or len(data) - length >= 4 * max_size:
+            return data, cuts + [c for c in ours if c < edge] + [edge], edge
+
+
+def _store_segment(path, chunks_dir, offset, length, size, min_size, avg_size, max_size, chunker='gear', mb_per_sec=None):
+    if mb_per_sec:
+        TokenBucket(mb_per_sec, burst_mb=length / 1024 / 1024).consume(length)
+    with open(path, 'rb') as file:
+        data, cuts, end = _segment_cuts(file, offset, length, size, min_size, avg_size, max_size, chunker)
+    result = []
+    start = offset
+    view = memoryview(data)
+    for cut in cuts:
+        chunk = view[start - offset:cut - offset]
+        digest = hashlib.sha256(chunk).hexdigest()
+        chunk_path = os.path.join(chunks_dir, digest[:2], digest)
+        new = not os.path.exists(chunk_path)
+        if new:
+            os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(chunk_path, os.getpid())
+            with open(tmp_path, 'wb') as chunk_file:
+                chunk_file.write(chunk)
+            os.replace(tmp_path, chunk_path)
+        result.append((start, digest, cut - start, new))
+        start = cut
+    return end, len(data), result
+
+
+class ChunkStore:
+    def __init__(self, repo_dir, avg_chunk_size=4 * 1024 * 1024, segment_size=64 * 1024 * 1024, workers=None, limiter=None,
+                 chunker='auto'):
+        self._logger = logging.getLogger('tableau_backup.ChunkStore')
+        self.limiter = limiter
+        self.repo_dir = repo_dir
+        self.chunks_dir = os.path.join(repo_dir, 'chunks')
+        self.recipes_dir = os.path.join(repo_dir, 'recipes')
+        self.avg_size = avg_chunk_size
+        self.min_size = avg_chunk_size // 4
+        self.max_size = avg_chunk_size * 4
+        # Segments are chunked independently in worker processes; each
+        # segment edge is a forced cut point.
+        self.segment_size = max(self.max_size, segment_size)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunker = self._select_chunker(chunker)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.recipes_dir, exist_ok=True)
+
+    def _select_chunker(self, chunker):
+        fits = (self.min_size >= FASTCDC_MIN_SIZE and self.avg_size >= FASTCDC_AVG_SIZE
+                and self.max_size >= FASTCDC_MAX_SIZE)
+        if chunker == 'fastcdc':
+            if fastcdc_cy is None:
+                raise RuntimeError('The fastcdc chunker requires the compiled fastcdc package (pip install fastcdc)')
+            if not fits:
+                raise ValueError('fastcdc needs avg_chunk_size >= {}'.format(FASTCDC_MAX_SIZE // 4))
+            return chunker
+        if chunker == 'gear':
+            return chunker
+        if chunker != 'auto':
+            raise ValueError('Unknown chunker: {}'.format(chunker))
+        if fastcdc_cy is not None and fits:
+            return 'fastcdc'
+        if fastcdc_cy is None:
+            self._logger.warning('fastcdc is not installed, chunking with the pure-Python gear scan at a few MB/s per worker')
+        return 'gear'
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _recipe_path(self, name):
+        return os.path.join(self.recipes_dir, name + '.json')
+
+    def add(self, path, name=None):
+        '''Splits path into chunks, stores unseen ones and writes a recipe. Returns stats.'''
+        name = name or os.path.basename(path)
+        size = os.path.getsize(path)
+        started = time.time()
+        self._logger.debug('Chunk {} ({} bytes) with {} workers, {} chunker'.format(path, size, self.workers, self.chunker))
+        mb_per_sec = self.limiter.share(self.workers) if self.limiter is not None else None
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(_store_segment, path, self.chunks_dir, offset, min(self.segment_size, size - offset), size,
+                                   self.min_size, self.avg_size, self.max_size, self.chunker, mb_per_sec)
+                       for offset in range(0, size, self.segment_size)]
+            chunks = []
+            dropped = []
+            position = 0
+            for future in futures:
+                end, read, segment = future.result()
+                if self.limiter is not None:
+                    self.limiter.record(read)
+                for start, digest, length, new in segment:
+                    # Chunks the previous segment already covered, see _segment_cuts.
+                    if start < position:
+                        dropped.append((digest, new))
+                        continue
+                    if start != position:
+                        raise RuntimeError('{}: chunks do not line up at offset {}'.format(path, position))
+                    chunks.append((digest, length, new))
+                    position += length
+        if position != size:
+            raise RuntimeError('{}: chunked {} of {} bytes'.format(path, position, size))
+        referenced = set(digest for digest, _, _ in chunks)
+        for digest, new in dropped:
+            if new and digest not in referenced:
+                try:
+                    os.remove(self._chunk_path(digest))
+                except OSError:
+                    pass
+        new_bytes = sum(length for _, length, new in chunks if new)
+        recipe = {'name': name, 'size': size, 'created': int(started), 'chunker': self.chunker,
+                  'chunks': [[digest, length] for digest, length, _ in chunks]}
+        tmp_path = self._recipe_path(name) + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(recipe, file)
+        os.replace(tmp_path, self._recipe_path(name))
+        stats = {'name': name, 'size': size, 'chunks': len(chunks), 'new_chunks': sum(1 for c in chunks if c[2]),
+                 'new_bytes': new_bytes, 'seconds': time.time() - started}
+        self._logger.info('Stored {}: {} chunks, {} new bytes of {}'.format(name, stats['chunks'], new_bytes, size))
+        return stats
+
+    def recipes(self):
+        names = [f[:-len('.json')] for f in os.listdir(self.recipes_dir) if f.endswith('.json')]
+        return sorted(names)
+
+    def recipe(self, name):
+        with open(self._recipe_path(name)) as json_file:
+            return json.load(json_file)
+
+    def restore(self, name, out):
+        '''Writes the backup named name to the binary stream out, verifying every chunk.'''
+        for digest, length in self.recipe(name)['chunks']:
+            with open(self._chunk_path(digest), 'rb') as chunk_file:
+                data = chunk_file.read()
+            if len(data) != length or hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError('Chunk {} of {} is corrupt'.format(digest, name))
+            out.write(data)
+
+    def remove(self, name):
+        os.remove(self._recipe_path(name))
+
+    def prune(self, keep, dry_run=False):
+        '''Removes the recipes not named in keep, then the chunks only they used. Returns (removed names, freed bytes).'''
+        removed = [name for name in self.recipes() if name not in keep]
+        if dry_run:
+            return removed, 0
+        for name in removed:
+            self._logger.info('Prune {} from the repository'.format(name))
+            self.remove(name)
+        return removed, self.gc()
+
+    def gc(self):
+        '''Removes chunks not referenced by any recipe. Returns freed bytes.'''
+        referenced = set()
+        for name in self.recipes():
+            referenced.update(digest for digest, _ in self.recipe(name)['chunks'])
+        freed = 0
+        for prefix in os.listdir(self.chunks_dir):
+            for entry in os.scandir(os.path.join(self.chunks_dir, prefix)):
+                if entry.name not in referenced:
+                    freed += entry.stat().st_size
+                    os.remove(entry.path)
+        return freed
@@ -0,0 +1,75 @@
+import atexit
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from sys import stdout
+
+# Every project logger is named tableau_backup.<Class>, so --debug is set on
+# this parent only; third-party debug output (botocore logs request signing
+# details) stays off.
+LOGGER_NAME = 'tableau_backup'
+QUIET_LOGGERS = ('urllib3', 'aiohttp', 'asyncio', 'botocore', 'boto3', 's3transfer')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + '.{:03d}'.format(int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class LogPipeline:
+    '''Routes every logger through a queue to a background writer thread.
+
+    Callers only enqueue records; console and rotating file output happen on
+    the listener thread, so polling loops never block on disk writes.
+    '''
+
+    def __init__(self, debug=False):
+        self.queue = queue.SimpleQueue()
+        console = logging.StreamHandler(stdout)
+        console.setFormatter(logging.Formatter('%(name)s: %(message)s'))
+        self.handlers = [console]
+        self.file_path = None
+        self.listener = None
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(QueueHandler(self.queue))
+        if debug:
+            logging.getLogger(LOGGER_NAME).setLevel(logging.DEBUG)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        self._start()
+        atexit.register(self.stop)
+
+    def _start(self):
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def configure_file(self, conf):
+        '''Adds (or replaces) the JSON-lines rotating file from the logging config section.'''
+        path = (conf or {}).get('file')
+        if not path or path == self.file_path:
+            return
+        handler = RotatingFileHandler(path, maxBytes=int(conf.get('maxBytes', 0)), backupCount=int(conf.get('backupCount', 0)))
+        handler.setFormatter(JsonLinesFormatter())
+        self.stop()
+        old = [h for h in self.handlers if isinstance(h, RotatingFileHandler)]
+        self.handlers = [h for h in self.handlers if h not in old] + [handler]
+        for h in old:
+            h.close()
+        self.file_path = path
+        self._start()
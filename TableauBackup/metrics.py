@@ -0,0 +1,128 @@
+import functools
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+
+from pyzabbix import ZabbixMetric, ZabbixSender  # pip install py-zabbix
+
+
+def _slug(name):
+    return re.sub(r'[^a-z0-9]+', '_', str(name).lower()).strip('_')
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _seconds(value):
+    value = float(value)
+    return value / 1000 if value > 1e11 else value
+
+
+@functools.lru_cache(maxsize=None)
+def zabbix_agent_config(path):
+    '''Returns (server, hostname) from a Zabbix agent config, parsed once per process.'''
+    with open(path) as file:
+        zabbix_file = file.read()
+    return re.search(r'ServerActive=(.+)', zabbix_file).group(1), re.search(r'Hostname=(.+)', zabbix_file).group(1)
+
+
+class Metrics:
+    '''Collects per-phase timings and gauges for one run.'''
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.values['phase.{}.seconds'.format(name)] = round(time.perf_counter() - started, 3)
+
+    def record_job(self, job):
+        '''Derives job duration and per-step timings from progressNotes timestamps.'''
+        created = job.get('createdAt')
+        previous = _seconds(created) if created else None
+        for note in (job.get('detailedProgress') or {}).get('progressNotes') or []:
+            timestamp = _seconds(note['timestamp'])
+            if previous is not None:
+                self.values['step.{}.seconds'.format(_slug(note['step']))] = round(timestamp - previous, 3)
+            previous = timestamp
+        if created and job.get('completedAt'):
+            self.values['job.seconds'] = round(_seconds(job['completedAt']) - _seconds(created), 3)
+        elif created and previous is not None:
+            self.values['job.seconds'] = round(previous - _seconds(created), 3)
+
+    def record_backup(self, size):
+        self.values['backup.size'] = size
+        if self.values.get('job.seconds'):
+            self.values['backup.mb_per_sec'] = round(size / self.values['job.seconds'] / 1024 / 1024, 3)
+
+
+class ZabbixSink:
+    def __init__(self, agent_config, item):
+        self._logger = logging.getLogger('tableau_backup.ZabbixSink')
+        self.server, self.hostname = zabbix_agent_config(agent_config)
+        self.item = item
+
+    def packet(self, metrics, status=None):
+        packet = []
+        if status is not None:
+            packet.append(ZabbixMetric(self.hostname, self.item, status))
+        for name, value in metrics.values.items():
+            packet.append(ZabbixMetric(self.hostname, '{}[{}]'.format(self.item, name), value))
+        return packet
+
+    def send(self, metrics, status=None):
+        packet = self.packet(metrics, status)
+        self._logger.debug(f'Send to {self.server} packet:{packet}')
+        return ZabbixSender(zabbix_server=self.server).send(packet)
+
+
+class JsonSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, metrics, status=None):
+        record = dict(metrics.values, timestamp=time.time())
+        if status is not None:
+            record['status'] = status
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+
+class PrometheusSink:
+    '''Writes a node_exporter textfile collector file, replaced atomically.'''
+
+    def __init__(self, path, prefix='tableau_backup'):
+        self.path = path
+        self.prefix = prefix
+
+    def send(self, metrics, status=None):
+        lines = []
+        values = dict(metrics.values)
+        if status is not None:
+            values['status'] = status
+        values['last_run.timestamp'] = time.time()
+        for name, value in sorted(values.items()):
+            if value is None:
+                continue
+            if isinstance(value, (bool, int, float)):
+                lines.append('{}_{} {}'.format(self.prefix, _slug(name), int(value) if isinstance(value, bool) else value))
+            else:
+                # Textfile samples must be numeric: a string becomes an info-style gauge labelled with it,
+                # e.g. staging.strategy = hardlink -> tableau_backup_staging_strategy{strategy="hardlink"} 1
+                label = _slug(name.rsplit('.', 1)[-1])
+                lines.append('{}_{}{{{}="{}"}} 1'.format(self.prefix, _slug(name), label, _label_value(value)))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import boto3  # pip install boto3
+except ImportError:
+    boto3 = None
+
+STATE_SUFFIX = '.upload.json'
+
+
+class S3Target:
+    def __init__(self, bucket, prefix='', endpoint_url=None, access_key=None, secret_key=None, region=None):
+        if boto3 is None:
+            raise RuntimeError('S3 offload requires the boto3 package (pip install boto3)')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, aws_access_key_id=access_key,
+                                   aws_secret_access_key=secret_key, region_name=region)
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def create(self, key, size):
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key))['UploadId']
+
+    def upload_part(self, key, upload_id, number, offset, data):
+        resp = self.client.upload_part(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id, PartNumber=number, Body=data)
+        return resp['ETag']
+
+    def complete(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                                              MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': e} for n, e in parts]})
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+
+class LocalTarget:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def create(self, key, size):
+        upload_id = self._path(key) + '.part'
+        with open(upload_id, 'wb') as file:
+            file.truncate(size)
+        return upload_id
+
+    def upload_part(self, key, upload_id, number, offset, data):
+        fd = os.open(upload_id, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+        return str(number)
+
+    def complete(self, key, upload_id, parts):
+        os.replace(upload_id, self._path(key))
+
+    def put(self, key, data):
+        tmp_path = self._path(key) + '.part'
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, self._path(key))
+
+
+class Uploader:
+    '''Parallel multipart upload with per-part state persisted next to the source for resuming.'''
+
+    def __init__(self, target, part_size=64 * 1024 * 1024, concurrency=4, limiter=None):
+        self._logger = logging.getLogger('tableau_backup.Uploader')
+        self.limiter = limiter
+        self.target = target
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+
+    def _load_state(self, path, key, stat):
+        try:
+            with open(path + STATE_SUFFIX) as json_file:
+                state = json.load(json_file)
+        except (OSError, ValueError):
+            return None
+        if (state.get('key'), state.get('size'), state.get('mtime'), state.get('part_size')) != (key, stat.st_size, stat.st_mtime, self.part_size):
+            self._logger.info('Upload state for {} is stale, starting over'.format(path))
+            return None
+        return state
+
+    def _save_state(self, path, state):
+        tmp_path = path + STATE_SUFFIX + '.tmp'
+        with open(tmp_path, 'w') as json_file:
+            json.dump(state, json_file)
+        os.replace(tmp_path, path + STATE_SUFFIX)
+
+    def _send_part(self, path, key, state, number):
+        offset = (number - 1) * self.part_size
+        if self.limiter is not None:
+            self.limiter.consume(min(self.part_size, state['size'] - offset))
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            data = os.pread(fd, self.part_size, offset)
+        finally:
+            os.close(fd)
+        etag = self.target.upload_part(key, state['upload_id'], number, offset, data)
+        with self._lock:
+            state['parts'][str(number)] = etag
+            self._save_state(path, state)
+        return len(data)
+
+    def upload(self, path, key=None):
+        key = key or os.path.basename(path)
+        stat = os.stat(path)
+        started = time.time()
+        if stat.st_size <= self.part_size:
+            with open(path, 'rb') as file:
+                self.target.put(key, file.read())
+            return self._stats(path, stat.st_size, stat.st_size, started)
+        state = self._load_state(path, key, stat)
+        if state is None:
+            state = {'key': key, 'size': stat.st_size, 'mtime': stat.st_mtime, 'part_size': self.part_size,
+                     'upload_id': self.target.create(key, stat.st_size), 'parts': {}}
+            self._save_state(path, state)
+        part_count = (stat.st_size + self.part_size - 1) // self.part_size
+        pending = [n for n in range(1, part_count + 1) if str(n) not in state['parts']]
+        self._logger.debug('Upload {}: {} parts, {} already sent'.format(path, part_count, part_count - len(pending)))
+        sent = 0
+        # Each worker reads only its own part, so memory stays at concurrency * part_size.
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(self._send_part, path, key, state, n) for n in pending]
+            for future in as_completed(futures):
+                sent += future.result()
+        parts = sorted((int(n), etag) for n, etag in state['parts'].items())
+        self.target.complete(key, state['upload_id'], parts)
+        os.remove(path + STATE_SUFFIX)
+        return self._stats(path, stat.st_size, sent, started)
+
+    def _stats(self, path, size, sent, started):
+        seconds = max(time.time() - started, 1e-9)
+        stats = {'path': path, 'size': size, 'sent': sent, 'seconds': seconds, 'mb_per_sec': sent / seconds / 1024 / 1024}
+        self._logger.info('Uploaded {}: {} bytes in {:.1f}s, {:.1f} MB/s'.format(path, sent, seconds, stats['mb_per_sec']))
+        return stats
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import statistics
+import time
+
+RUNNING_STATUSES = ('Created', 'Running')
+
+
+class JobPoller:
+    '''Polls one TSM async job with an adaptive interval and dispatches events to subscribers.
+
+    Events: 'note' (job, note) for every new progress note, 'status' (job, old, new)
+    on status changes and 'done' (job) once the job leaves the running states.
+    '''
+    EVENTS = ('note', 'status', 'done')
+
+    def __init__(self, tsm, job_id, min_interval=1, max_interval=30, backoff=1.5):
+        self._logger = logging.getLogger('tableau_backup.JobPoller')
+        self.tsm = tsm
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.interval = min_interval
+        self.job = None
+        self.polls = 0
+        self._subscribers = {event: [] for event in self.EVENTS}
+        self._cursor = 0
+        self._status = None
+        self._step_started = time.time()
+        self._step_durations = []
+
+    def subscribe(self, event, callback):
+        self._subscribers[event].append(callback)
+        return self
+
+    def _dispatch(self, event, *args):
+        for callback in self._subscribers[event]:
+            callback(*args)
+
+    def _expected_step_left(self, now):
+        if not self._step_durations:
+            return None
+        return statistics.median(self._step_durations) - (now - self._step_started)
+
+    def _adapt(self, changed, now):
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        # Poll faster when the current step is about to finish, judging by
+        # how long previous steps of this job took.
+        left = self._expected_step_left(now)
+        if left is not None and left < self.interval:
+            self.interval = max(self.min_interval, left)
+
+    def update(self, job):
+        '''Feeds one job snapshot. Returns True when the job is finished.'''
+        now = time.time()
+        self.job = job
+        notes = (job.get('detailedProgress') or {}).get('progressNotes') or []
+        new_notes = notes[self._cursor:]
+        self._cursor = len(notes)
+        for note in new_notes:
+            self._dispatch('note', job, note)
+        if new_notes:
+            self._step_durations.append(now - self._step_started)
+            self._step_started = now
+        status = job['status']
+        if status != self._status:
+            self._dispatch('status', job, self._status, status)
+            self._status = status
+        self._adapt(bool(new_notes), now)
+        if status not in RUNNING_STATUSES:
+            self._dispatch('done', job)
+            return True
+        return False
+
+    def poll_once(self):
+        self.polls += 1
+        return self.update(self.tsm.get_job(job_id=self.job_id))
+
+    async def poll_once_async(self):
+        '''poll_once for an AsyncTSMApi client.'''
+        self.polls += 1
+        return self.update(await self.tsm.get_job(job_id=self.job_id))
+
+    def _poll_failed(self, e, deadline):
+        # A failed poll says nothing about the job: keep polling until the
+        # deadline (the job timeout), after which TSM has ended the job anyway.
+        if deadline is None or time.time() >= deadline:
+            raise e
+        self._logger.error('job %s: poll failed: %s', self.job_id, e)
+        return self.max_interval
+
+    def run(self, deadline=None):
+        '''Polls until the job is finished and returns the final job.
+
+        Poll errors are retried until deadline (a time.time() value); without one they are raised.
+        '''
+        while True:
+            try:
+                if self.poll_once():
+                    break
+                delay = self.interval
+            except Exception as e:
+                delay = self._poll_failed(e, deadline)
+            self._logger.debug('job %s: %s, next poll in %.1fs', self.job_id, self._status, delay)
+            time.sleep(delay)
+        self._logger.debug('job %s finished after %s polls', self.job_id, self.polls)
+        return self.job
+
+    async def run_async(self, deadline=None):
+        '''run for an AsyncTSMApi client.'''
+        while True:
+            try:
+                if await self.poll_once_async():
+                    break
+                delay = self.interval
+            except Exception as e:
+                delay = self._poll_failed(e, deadline)
+            await asyncio.sleep(delay)
+        return self.job
@@ -0,0 +1,136 @@
+import logging
+import os
+import shutil
+import time
+
+SIDECAR_SUFFIXES = ('.sha256', '.manifest.json', '.settings.json', '.topology.json', '.bundle.json', '.upload.json')
+
+
+class Backup:
+    __slots__ = ('name', 'mtime', 'size', 'data_size', 'paths')
+
+    def __init__(self, name):
+        self.name = name
+        self.mtime = 0
+        self.size = 0
+        self.data_size = 0
+        self.paths = []
+
+
+class Inventory:
+    '''Backups in a directory grouped with their sidecars, built from a single scandir pass.'''
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.backups = []
+        self.total = 0
+        self.scan()
+
+    @staticmethod
+    def _backup_name(file_name):
+        for suffix in SIDECAR_SUFFIXES:
+            if file_name.endswith(suffix):
+                return file_name[:-len(suffix)], True
+        return file_name, False
+
+    def scan(self):
+        groups = {}
+        with os.scandir(self.backup_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                name, sidecar = self._backup_name(entry.name)
+                backup = groups.setdefault(name, Backup(name))
+                stat = entry.stat(follow_symlinks=False)
+                backup.size += stat.st_size
+                backup.paths.append(entry.path)
+                if not sidecar:
+                    backup.mtime = stat.st_mtime
+                    backup.data_size = stat.st_size
+        self.backups = sorted((b for b in groups.values() if b.data_size), key=lambda b: b.mtime)
+        # Orphaned sidecars are kept out of the policy; they are always safe to prune.
+        self.orphans = [b for b in groups.values() if not b.data_size]
+        self.total = sum(b.size for b in groups.values())
+        return self
+
+    def latest_size(self):
+        return self.backups[-1].data_size if self.backups else 0
+
+    def remove(self, backup):
+        if backup in self.backups:
+            self.backups.remove(backup)
+        elif backup in self.orphans:
+            self.orphans.remove(backup)
+        self.total -= backup.size
+
+
+class RetentionPolicy:
+    def __init__(self, keep_last=1, daily=0, weekly=0, monthly=0, max_bytes=None):
+        self._logger = logging.getLogger('tableau_backup.RetentionPolicy')
+        self.keep_last = keep_last
+        self.daily = daily
+        self.weekly = weekly
+        self.monthly = monthly
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, conf):
+        max_bytes = conf.get('max_bytes')
+        return cls(keep_last=int(conf.get('keep_last', 1)), daily=int(conf.get('daily', 0)), weekly=int(conf.get('weekly', 0)),
+                   monthly=int(conf.get('monthly', 0)), max_bytes=int(max_bytes) if max_bytes else None)
+
+    @staticmethod
+    def _newest_per_period(backups, count, period):
+        kept = []
+        seen = set()
+        for backup in reversed(backups):
+            key = period(time.localtime(backup.mtime))
+            if key not in seen:
+                if len(seen) == count:
+                    break
+                seen.add(key)
+                kept.append(backup)
+        return kept
+
+    def protected(self, backups):
+        '''Backups kept by the keep-last and grandfather-father-son rules.'''
+        keep = set(b.name for b in backups[len(backups) - self.keep_last:]) if self.keep_last else set()
+        rules = ((self.daily, lambda t: (t.tm_year, t.tm_yday)),
+                 (self.weekly, lambda t: time.strftime('%G-%V', t)),
+                 (self.monthly, lambda t: (t.tm_year, t.tm_mon)))
+        for count, period in rules:
+            if count:
+                keep.update(b.name for b in self._newest_per_period(backups, count, period))
+        return keep
+
+    def plan(self, inventory, required_bytes=0, free_bytes=None):
+        '''Returns orphaned sidecars and every backup the keep-last and GFS rules do not keep, oldest first.
+
+        Free space and max_bytes never remove a protected backup; if the
+        unprotected ones are not enough, a warning is logged.
+        '''
+        if free_bytes is None:
+            free_bytes = shutil.disk_usage(inventory.backup_dir).free
+        needed = required_bytes - free_bytes
+        if self.max_bytes is not None:
+            needed = max(needed, inventory.total + required_bytes - self.max_bytes)
+        keep = self.protected(inventory.backups)
+        prune = list(inventory.orphans) + [b for b in inventory.backups if b.name not in keep]
+        needed -= sum(b.size for b in prune)
+        if needed > 0:
+            self._logger.warning('Retention cannot free enough space, {} bytes still missing'.format(needed))
+        return prune
+
+    def apply(self, inventory, required_bytes=0, free_bytes=None, dry_run=False):
+        pruned = []
+        for backup in self.plan(inventory, required_bytes, free_bytes):
+            self._logger.info('Prune {} ({} bytes)'.format(backup.name, backup.size))
+            if not dry_run:
+                for path in backup.paths:
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        self._logger.error('Error while removing {}: {}'.format(path, e))
+                inventory.remove(backup)
+            pruned.append(backup)
+        return pruned
@@ -0,0 +1,134 @@
+import datetime
+import fcntl
+import logging
+import os
+
+
+class CronSchedule:
+    '''Five-field cron expression: minute hour day-of-month month day-of-week.'''
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError('Cron expression must have 5 fields: "{}"'.format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES)]
+        # Sunday is both 0 and 7.
+        if 7 in self.weekdays:
+            self.weekdays = self.weekdays | {0}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(v) for v in part.split('-')]
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError('Cron field "{}" out of range {}-{}'.format(field, low, high))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        # Like cron: when both day fields are restricted either one may match.
+        if not self._any_day and not self._any_weekday:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, dt):
+        '''Returns the first matching minute strictly after dt.'''
+        dt = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = dt + datetime.timedelta(days=5 * 366)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError('Cron expression "{}" never matches'.format(self.expression))
+
+
+class RunLock:
+    '''Non-blocking exclusive flock, so two backup runs never overlap.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+        # O_NOFOLLOW: a symlink planted at the lock path must not get truncated and written through.
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError('{} is locked by another run'.format(self.path))
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Scheduler:
+    def __init__(self):
+        self._logger = logging.getLogger('tableau_backup.Scheduler')
+        self.jobs = []
+
+    def add(self, name, expression, func, now=None):
+        schedule = CronSchedule(expression)
+        next_run = schedule.next_after(now or datetime.datetime.now())
+        self.jobs.append({'name': name, 'schedule': schedule, 'func': func, 'next_run': next_run})
+        self._logger.info('Scheduled {} "{}", next run at {}'.format(name, expression, next_run))
+
+    def clear(self):
+        self.jobs = []
+
+    def seconds_until_next(self, now=None):
+        if not self.jobs:
+            return None
+        now = now or datetime.datetime.now()
+        return max(0.0, (min(job['next_run'] for job in self.jobs) - now).total_seconds())
+
+    def due(self, now=None):
+        '''Returns due jobs and moves their next run forward.'''
+        now = now or datetime.datetime.now()
+        due = []
+        for job in self.jobs:
+            if job['next_run'] <= now:
+                due.append(job)
+                job['next_run'] = job['schedule'].next_after(now)
+        return due
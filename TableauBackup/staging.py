@@ -0,0 +1,106 @@
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+from TableauBackup.checksum import SIDECAR_SUFFIX, Sha256Engine
+
+FICLONE = 0x40049409
+COPY_CHUNK = 64 * 1024 * 1024
+
+
+class StagingError(Exception):
+    pass
+
+
+class Stager:
+    '''Moves backups into long-term storage with the cheapest copy the filesystems allow.'''
+    STRATEGIES = ('reflink', 'hardlink', 'copy_file_range', 'sendfile', 'copy')
+
+    def __init__(self, strategies=None, limiter=None, block_size=8 * 1024 * 1024):
+        self._logger = logging.getLogger('tableau_backup.Stager')
+        self.strategies = strategies or self.STRATEGIES
+        self.limiter = limiter
+        self.block_size = block_size
+
+    def _consume(self, size):
+        if self.limiter is not None:
+            self.limiter.consume(size)
+
+    def _reflink(self, src, dst, size):
+        with open(src, 'rb') as in_file, open(dst, 'wb') as out_file:
+            fcntl.ioctl(out_file.fileno(), FICLONE, in_file.fileno())
+
+    def _hardlink(self, src, dst, size):
+        os.link(src, dst)
+
+    def _kernel_copy(self, src, dst, size, copy):
+        with open(src, 'rb') as in_file, open(dst, 'wb') as out_file:
+            offset = 0
+            while offset < size:
+                count = min(COPY_CHUNK, size - offset)
+                self._consume(count)
+                copied = copy(in_file.fileno(), out_file.fileno(), offset, count)
+                if copied == 0:
+                    raise StagingError('{}: short copy at {}'.format(src, offset))
+                offset += copied
+
+    def _copy_file_range(self, src, dst, size):
+        self._kernel_copy(src, dst, size, lambda fd_in, fd_out, offset, count: os.copy_file_range(fd_in, fd_out, count, offset, offset))
+
+    def _sendfile(self, src, dst, size):
+        self._kernel_copy(src, dst, size, lambda fd_in, fd_out, offset, count: os.sendfile(fd_out, fd_in, offset, count))
+
+    def _copy(self, src, dst, size):
+        sha256_hash = hashlib.sha256()
+        buf = bytearray(self.block_size)
+        view = memoryview(buf)
+        with open(src, 'rb', buffering=0) as in_file, open(dst, 'wb') as out_file:
+            while True:
+                read = in_file.readinto(buf)
+                if not read:
+                    break
+                self._consume(read)
+                sha256_hash.update(view[:read])
+                out_file.write(view[:read])
+        return sha256_hash.hexdigest()
+
+    def stage(self, src, dst_dir):
+        '''Stages src and its .sha256 into dst_dir. Returns strategy, timing and verification.'''
+        os.makedirs(dst_dir, exist_ok=True)
+        dst = os.path.join(dst_dir, os.path.basename(src))
+        size = os.path.getsize(src)
+        expected = Sha256Engine.read_sidecar(src) if os.path.exists(src + SIDECAR_SUFFIX) else None
+        tmp_dst = dst + '.staging'
+        for strategy in self.strategies:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            started = time.time()
+            try:
+                digest = getattr(self, '_' + strategy)(src, tmp_dst, size)
+            except (OSError, AttributeError, StagingError) as e:
+                if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                    raise
+                self._logger.debug('{} failed for {}: {}'.format(strategy, src, e))
+                continue
+            if os.path.getsize(tmp_dst) != size:
+                raise StagingError('{}: staged size differs from source'.format(dst))
+            # Only the userspace copy reads the data; its digest is checked
+            # against the sidecar. Clones and links share the source blocks,
+            # kernel copies are trusted after the size check.
+            verified = 'size'
+            if digest is not None and expected is not None:
+                if digest != expected:
+                    os.remove(tmp_dst)
+                    raise StagingError('{}: sha256 {} does not match sidecar {}'.format(dst, digest, expected))
+                verified = 'sha256'
+            os.replace(tmp_dst, dst)
+            if expected is not None:
+                shutil.copyfile(src + SIDECAR_SUFFIX, dst + SIDECAR_SUFFIX)
+            seconds = time.time() - started
+            self._logger.info('Staged {} with {} in {:.1f}s'.format(dst, strategy, seconds))
+            return {'path': dst, 'strategy': strategy, 'seconds': seconds, 'size': size, 'verified': verified}
+        raise StagingError('{}: no staging strategy succeeded'.format(src))
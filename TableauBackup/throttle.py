@@ -0,0 +1,138 @@
+import ctypes
+import datetime
+import logging
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+
+# ioprio_set(2) has no libc wrapper.
+SYS_IOPRIO_SET = {'x86_64': 251, 'aarch64': 30, 'i686': 289, 'ppc64le': 273, 's390x': 282}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+
+MB = 1024 * 1024
+
+
+def set_low_priority(io_class='idle', level=7, nice=10):
+    '''Lowers CPU and I/O scheduling priority of this process and the ones it forks.'''
+    logger = logging.getLogger('tableau_backup.throttle')
+    try:
+        os.nice(nice)
+    except OSError as e:
+        logger.warning('nice failed: {}'.format(e))
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if number is None:
+        logger.warning('ioprio_set is not supported on {}'.format(platform.machine()))
+        return False
+    ioprio = IOPRIO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT | level
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+        logger.warning('ioprio_set failed: {}'.format(os.strerror(ctypes.get_errno())))
+        return False
+    logger.debug('I/O class set to {}'.format(io_class))
+    return True
+
+
+class TokenBucket:
+    '''Thread-safe byte rate limiter with optional time-of-day rate profiles.
+
+    profiles: [{"from": "08:00", "to": "20:00", "mb_per_sec": 20}, ...]; the
+    first matching window wins, otherwise the default rate applies. A rate of
+    0 or None means unlimited.
+    '''
+
+    def __init__(self, mb_per_sec=None, burst_mb=None, profiles=None):
+        self._logger = logging.getLogger('tableau_backup.TokenBucket')
+        self.default_rate = mb_per_sec * MB if mb_per_sec else None
+        self.burst = (burst_mb * MB) if burst_mb else None
+        self.profiles = [(self._minutes(p['from']), self._minutes(p['to']), p.get('mb_per_sec')) for p in profiles or []]
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.consumed = 0
+        self.waited = 0.0
+        self.started = None
+        self.stopped = None
+
+    @staticmethod
+    def _minutes(value):
+        hours, minutes = value.split(':')
+        return int(hours) * 60 + int(minutes)
+
+    def rate(self, now=None):
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, mb_per_sec in self.profiles:
+            inside = start <= minute < end if start <= end else minute >= start or minute < end
+            if inside:
+                return mb_per_sec * MB if mb_per_sec else None
+        return self.default_rate
+
+    def consume(self, size):
+        '''Blocks until size bytes may be transferred.'''
+        rate = self.rate()
+        with self._lock:
+            self.consumed += size
+            if not rate:
+                return
+            now = time.monotonic()
+            burst = self.burst or rate
+            self._tokens = min(burst, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= size
+            delay = -self._tokens / rate if self._tokens < 0 else 0
+            self.waited += delay
+        if delay:
+            time.sleep(delay)
+
+    def record(self, size):
+        '''Counts bytes read by worker processes, which throttle themselves with share().'''
+        with self._lock:
+            self.consumed += size
+
+    @contextmanager
+    def window(self):
+        '''Resets the counters and measures the effective rate over the block only.'''
+        with self._lock:
+            self.consumed = 0
+            self.waited = 0.0
+            self.started = time.monotonic()
+            self.stopped = None
+        try:
+            yield self
+        finally:
+            self.stopped = time.monotonic()
+
+    def share(self, workers):
+        '''Rate in MB/s for each of workers processes that cannot share this bucket.'''
+        rate = self.rate()
+        return rate / MB / workers if rate else None
+
+    def effective_rate(self):
+        if self.started is None:
+            return 0.0
+        seconds = max((self.stopped or time.monotonic()) - self.started, 1e-9)
+        return self.consumed / seconds / MB
+
+
+_limiter = None
+_low_priority = False
+
+
+def configure(conf):
+    '''Builds the process-wide limiter from the io config section.'''
+    global _limiter, _low_priority
+    if conf.get('low_priority') and not _low_priority:
+        _low_priority = set_low_priority(conf.get('io_class', 'idle'))
+    if conf.get('mb_per_sec') or conf.get('profiles'):
+        _limiter = TokenBucket(conf.get('mb_per_sec'), conf.get('burst_mb'), conf.get('profiles'))
+    else:
+        _limiter = None
+    return _limiter
+
+
+def limiter():
+    return _limiter
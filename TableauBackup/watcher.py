@@ -0,0 +1,106 @@
+import logging
+import time
+
+from TableauBackup.poller import RUNNING_STATUSES
+
+
+class JobRecord:
+    __slots__ = ('id', 'job_type', 'status', 'status_message', 'progress', 'note_count', 'updated')
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.job_type = None
+        self.status = None
+        self.status_message = None
+        self.progress = None
+        self.note_count = 0
+        self.updated = 0.0
+
+    @property
+    def running(self):
+        return self.status in RUNNING_STATUSES
+
+
+class JobWatcher:
+    '''Tracks many TSM async jobs with one asyncJobs request per tick.
+
+    Events: 'status' (record, old, new), 'note' (record, note) for new progress
+    notes and 'done' (record) when a job leaves the running states.
+    '''
+    EVENTS = ('status', 'note', 'done')
+
+    def __init__(self, tsm, interval=2, track_all=False):
+        self._logger = logging.getLogger('tableau_backup.JobWatcher')
+        self.tsm = tsm
+        self.interval = interval
+        self.track_all = track_all
+        self.records = {}
+        self.ticks = 0
+        self._tracked = set()
+        self._subscribers = {event: [] for event in self.EVENTS}
+
+    def subscribe(self, event, callback):
+        self._subscribers[event].append(callback)
+        return self
+
+    def _dispatch(self, event, *args):
+        for callback in self._subscribers[event]:
+            callback(*args)
+
+    def track(self, job_id):
+        self._tracked.add(str(job_id))
+
+    def untrack(self, job_id):
+        self._tracked.discard(str(job_id))
+        self.records.pop(str(job_id), None)
+
+    @property
+    def active(self):
+        return [r for r in self.records.values() if r.running or r.status is None]
+
+    @property
+    def pending(self):
+        '''Tracked jobs that have not finished yet, including ones not listed by TSM so far.'''
+        return [job_id for job_id in self._tracked if job_id not in self.records or self.records[job_id].running]
+
+    def tick(self):
+        self.ticks += 1
+        now = time.time()
+        for job in self.tsm.get_jobs() or []:
+            job_id = str(job['id'])
+            if not self.track_all and job_id not in self._tracked:
+                continue
+            record = self.records.get(job_id)
+            if record is None:
+                record = self.records[job_id] = JobRecord(job_id)
+                # Jobs that were already over before we started watching are not news.
+                if self.track_all and job['status'] not in RUNNING_STATUSES and job_id not in self._tracked:
+                    record.status = job['status']
+                    record.note_count = len((job.get('detailedProgress') or {}).get('progressNotes') or [])
+                    continue
+            notes = (job.get('detailedProgress') or {}).get('progressNotes')
+            if notes is not None and len(notes) > record.note_count:
+                for note in notes[record.note_count:]:
+                    self._dispatch('note', record, note)
+                record.note_count = len(notes)
+            record.job_type = job.get('jobType')
+            record.status_message = job.get('statusMessage')
+            record.progress = job.get('progress')
+            record.updated = now
+            if job['status'] != record.status:
+                old_status = record.status
+                record.status = job['status']
+                self._dispatch('status', record, old_status, record.status)
+                if not record.running:
+                    self._dispatch('done', record)
+
+    def run(self, until=None):
+        '''Ticks until until() is true, or forever without it.'''
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                self._logger.error('asyncJobs poll failed: {}'.format(e))
+            if until is not None and until():
+                return
+            time.sleep(self.interval)
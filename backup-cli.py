@@ -1,15 +1,41 @@
 #!/usr/bin/env python3
 
 import click
+import asyncio
 import logging
 import os
 import time
 import json
-import re
+import signal
+import zipfile
 import hashlib
-from sys import stdout
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from TSMApi import TSMApi
-from pyzabbix import ZabbixMetric, ZabbixSender # pip install py-zabbix
+from TSMApi.cli import TABLEAU_PROFILE, TSMCli, TSMCommandError
+from TSMApi.session_cache import SessionCache
+try:
+    from TSMApi.aio import AsyncTSMApi
+except ImportError:
+    AsyncTSMApi = None
+from TableauBackup.checksum import Sha256Engine
+from TableauBackup.dedup import ChunkStore
+from TableauBackup.archive import ArchiveVerifier
+from TableauBackup.staging import Stager
+from TableauBackup.crypto import ChunkCipher, ENCRYPTED_SUFFIX, load_key
+from TableauBackup.compress import StreamCompressor
+from TableauBackup.poller import JobPoller
+from TableauBackup.watcher import JobWatcher
+from TableauBackup.capacity import AdmissionControl, SizeForecast
+from TableauBackup.catalog import Catalog
+from TableauBackup.retention import Backup, Inventory, RetentionPolicy
+from TableauBackup.offload import LocalTarget, S3Target, Uploader
+from TableauBackup.scheduler import RunLock, Scheduler
+from TableauBackup import throttle
+from TableauBackup.logs import LogPipeline
+from TableauBackup.metrics import JsonSink, Metrics, PrometheusSink, ZabbixSink
 
 config_file = 'config.json'
 script_home = os.path.dirname(os.path.realpath(__file__))
@@ -18,46 +44,78 @@ config_path = os.path.join(script_home, config_file)
 
 class TableauBackupCLI:
     def __init__(self, config_path, debug):
-        self._logger = logging.getLogger('TableauBackupCLI')
-        if debug:
-            self._logger.setLevel(logging.DEBUG)
-        else:
-            self._logger.setLevel(logging.INFO)
-        h1 = logging.StreamHandler(stdout)
-        f1 = logging.Formatter('%(name)s: %(message)s')
-        h1.setFormatter(f1)
-        self._logger.addHandler(h1)
+        self._logs = LogPipeline(debug)
+        self._logger = logging.getLogger('tableau_backup.TableauBackupCLI')
         self._logger.debug('Run in debug mode')
         self._config_path = config_path
+        self.metrics = Metrics()
+        self.tsm = None
+        self._keep_session = False
+        self._session_expires = 0
+        self._login_failures = 0
+        self._reload = False
 
     def _load_config(self):
         self._logger.debug('Load config from {}'.format(self._config_path))
-        with open(self._config_path) as json_file:
-            self.config =json.load(json_file)
+        with self.metrics.phase('config_load'):
+            with open(self._config_path) as json_file:
+                self.config =json.load(json_file)
+        self._logs.configure_file(self.config.get('logging'))
+        # One rate limiter shared by hashing, compression, chunking and upload.
+        self.limiter = throttle.configure(self.config.get('io', {}))
 
-    def _login_in_tsm(self):
-        self._load_config()
-        creds = self.config.get('tsm')
+    def _tsm_targets(self):
+        # The tsm section holds one server or a list of named clusters.
+        targets = self.config.get('tsm')
+        if isinstance(targets, dict):
+            return [dict(targets, name=targets.get('name', 'default'))]
+        # Unnamed list entries are reported under their url.
+        return [dict(creds, name=creds.get('name') or creds.get('url') or 'cluster{}'.format(i)) for i, creds in enumerate(targets)]
+
+    def _connect(self, creds):
         self._logger.debug('Login in {} with {} username'.format(creds.get('url'), creds.get('username')))
-        self.tsm = TSMApi(url=creds.get('url'))
-        self.tsm.login(username=creds.get('username'), password=creds.get('password'))
+        with self.metrics.phase('tsm_login'):
+            cache_conf = creds.get('session_cache', {})
+            cache = SessionCache(cache_conf['path'], ttl=int(cache_conf.get('ttl', 1800))) if cache_conf.get('path') else None
+            tsm = TSMApi(url=creds.get('url'), port=creds.get('port', 8850), session_cache=cache, timeout=float(creds.get('timeout', 60)))
+            tsm.login(username=creds.get('username'), password=creds.get('password'))
+        if cache is not None:
+            self._logger.debug('session cache hits: {}, misses: {}'.format(cache.hits, cache.misses))
+        return tsm
+
+    def _login_in_tsm(self):
+        # The daemon keeps one session warm and refreshes it before it expires.
+        if self._keep_session and self.tsm is not None and time.time() < self._session_expires:
+            return
+        if not self._keep_session:
+            self._load_config()
+        self.tsm = self._connect(self._tsm_targets()[0])
+        daemon_conf = self.config.get('daemon', {})
+        self._session_expires = time.time() + int(daemon_conf.get('session_ttl', 1800)) - int(daemon_conf.get('session_margin', 120))
+
+    def _job_poller(self, job_id, tsm=None):
+        conf = self.config.get('poll', {})
+        return JobPoller(tsm or self.tsm, job_id, min_interval=float(conf.get('min_interval', 1)),
+                         max_interval=float(conf.get('max_interval', 30)))
+
+    def _echo_note(self, job, note):
+        click.echo('{}: {} - {}'.format(note['step'], note['status'], note['message']))
+
+    def _echo_result(self, job):
+        click.echo('------------------------')
+        click.echo('{}: {}'.format(job['status'], job['statusMessage']))
+
+    def _log_status(self, job, old_status, new_status):
+        self._logger.debug('job {}: {} -> {}'.format(job.get('id'), old_status, new_status))
+
+    def _poll_job(self, job_id, print_msg=True):
+        poller = self._job_poller(job_id)
+        poller.subscribe('status', self._log_status)
+        if print_msg:
+            poller.subscribe('note', self._echo_note)
+            poller.subscribe('done', self._echo_result)
+        return poller.run()['status']
 
-    def _poll_job(self, job_id, print_msg=True, poll_interval=1):
-        msg_timestamp = 0
-        while True:
-            resp = self.tsm.get_job(job_id=job_id)
-            job_status = resp['status']
-            if print_msg:
-                for d in resp['detailedProgress']['progressNotes']:
-                    if msg_timestamp < d['timestamp']:
-                        click.echo('{}: {} - {}'.format(d['step'], d['status'], d['message']))
-                        msg_timestamp = d['timestamp']
-            if job_status not in ['Created', 'Running']:
-                if print_msg:
-                    click.echo('------------------------')
-                    click.echo('{}: {}'.format(resp['status'], resp['statusMessage']))
-                return resp['status']
-            time.sleep(poll_interval)
     def _clean_backup_dir(self):
         backup_dir = self.config['backup']['backup_dir']
         for file in os.listdir(backup_dir):
@@ -69,33 +127,289 @@ class TableauBackupCLI:
             except Exception as e:
                 self._logger.error(f"Error while cleaning {backup_dir}: {e}")
 
-    def _send_to_zabbix(self, value):
+    def _apply_retention(self, dry_run=False):
+        conf = self.config.get('retention', {})
+        inventory = Inventory(self.config['backup']['backup_dir'])
+        # The next backup is expected to be about the size of the latest one.
+        required = inventory.latest_size() if conf.get('reserve_next', True) else 0
+        pruned = RetentionPolicy.from_config(conf).apply(inventory, required_bytes=required, dry_run=dry_run)
+        self._logger.info('Retention: pruned {} backups, {} bytes'.format(len(pruned), sum(b.size for b in pruned)))
+        return pruned
+
+    def _size_forecast(self, catalog, window):
+        history = catalog.size_history(window)
+        if not history:
+            # No runs recorded yet: fall back to what is on disk.
+            inventory = Inventory(self.config['backup']['backup_dir'])
+            history = [(b.mtime, b.data_size) for b in inventory.backups]
+        return SizeForecast(history, window)
+
+    def _admit_backup(self, catalog):
+        conf = self.config.get('admission', {})
+        backup_dir = self.config['backup']['backup_dir']
+        forecast = self._size_forecast(catalog, int(conf.get('window', 10)))
+        self.metrics.set('admission.growth_bytes_per_day', int(forecast.growth_per_day()))
+        admission = AdmissionControl.from_config(backup_dir, conf)
+        retention = self.config.get('retention', {})
+        # Admission only deletes backups when retention is enabled as well.
+        policy = RetentionPolicy.from_config(retention) if retention.get('enabled') else None
+        if admission.mode == 'prune' and policy is None:
+            self._logger.warning('admission.mode is prune but retention is disabled, nothing will be pruned')
+        with self.metrics.phase('admission'):
+            return admission.admit(forecast.predict(), policy, Inventory(backup_dir), self.metrics)
+
+    def _timed_retention(self):
+        with self.metrics.phase('cleanup'):
+            return self._apply_retention()
+
+    def prune(self, dry_run):
+        self._load_config()
+        for backup in self._apply_retention(dry_run):
+            click.echo('{}\t{}'.format(backup.name, backup.size))
+
+    def _send_to_zabbix(self, value, item=None):
         zab_conf = self.config.get('zabbix')
         if not zab_conf:
             click.echo('There is no zabbix section in the config file')
+            return None
+        sink = ZabbixSink(zab_conf.get('config'), item or zab_conf.get('backup_item'))
+        # The status and every collected metric go out as one packet.
+        return sink.send(self.metrics, status=value)
+
+    def _export_metrics(self, status=None):
+        conf = self.config.get('metrics', {})
+        sinks = []
+        if conf.get('json'):
+            sinks.append(JsonSink(conf['json']))
+        if conf.get('prometheus'):
+            sinks.append(PrometheusSink(conf['prometheus']))
+        for sink in sinks:
+            try:
+                sink.send(self.metrics, status=status)
+            except Exception as e:
+                self._logger.error('Error while exporting metrics to {}: {}'.format(type(sink).__name__, e))
+
+    def _backup_path(self, backup_name):
+        backup_dir = self.config['backup']['backup_dir']
+        file_path = os.path.join(backup_dir, backup_name)
+        if not os.path.exists(file_path) and os.path.exists(file_path + '.tsbak'):
+            file_path += '.tsbak'
+        return file_path
+
+    def _checksum_engine(self):
+        conf = self.config.get('checksum', {})
+        return Sha256Engine(block_size=int(conf.get('block_size', 8 * 1024 * 1024)),
+                            chunk_size=int(conf.get('chunk_size', 256 * 1024 * 1024)),
+                            workers=conf.get('workers'), limiter=self.limiter)
+
+    def calculate_sha256(self, backup_name):
+        file_path = self._backup_path(backup_name)
+        engine = self._checksum_engine()
+        if not self.config.get('checksum', {}).get('manifest'):
+            return engine.file_digest(file_path)
+        # One read pass feeds both the .sha256 and the manifest chunk hashes.
+        sha256sum, manifest = engine.digest_with_manifest(file_path)
+        self._write_manifest(engine, file_path, manifest)
+        return sha256sum
+
+    def _write_manifest(self, engine, file_path, manifest):
+        self._logger.info('Manifest: {}, root: {}'.format(engine.write_manifest(file_path, manifest), manifest['root']))
+
+    def write_sha256sum_to_file(self, backup_name, sha256sum):
+        file_path = self._backup_path(backup_name)
+        self._logger.info('sha256: {} {}'.format(sha256sum, Sha256Engine.write_sidecar(file_path, sha256sum)))
+
+    def verify(self, manifest_path, workers):
+        self._load_config()
+        engine = self._checksum_engine()
+        if workers:
+            engine.workers = workers
+        bad_chunks = engine.verify_manifest(manifest_path)
+        if bad_chunks:
+            click.echo('{}: {} corrupt chunks: {}'.format(manifest_path, len(bad_chunks), bad_chunks))
+            quit(1)
+        click.echo('{}: OK'.format(manifest_path))
+
+    def verify_archive(self, path, workers):
         try:
-            zabbix_file = open(zab_conf.get('config')).read()
-        except Exception as e:
-            self.l.error(f"Error reading from file{zab_conf.get('config')}: {e}")
-            raise e
-        zab_server = re.search(r'ServerActive=(.+)', zabbix_file).group(1)
-        zab_hostname = re.search(r'Hostname=(.+)', zabbix_file).group(1)
-        packet = [ZabbixMetric(zab_hostname, zab_conf.get('backup_item'), value)]
-        self._logger.debug(f'Send to {zab_server} packet:{packet}')
-        return ZabbixSender(zabbix_server=zab_server).send(packet)
-
-    def calculate_sha256(file_path):
-        file_path = "/var/opt/tableau/tableau_server/data/tabsvc/files/backups/" + file_path
-        sha256_hash = hashlib.sha256()
-        with open(file_path, 'rb') as file:
-            for chunk in iter(lambda: file.read(4096), b''):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
-
-    def write_sha256sum_to_file(file_path, sha256sum):
-        file_path = "/var/opt/tableau/tableau_server/data/tabsvc/files/backups/" + file_path
-        with open(file_path, 'w') as file:
-            file.write(sha256sum)       
+            stats = ArchiveVerifier(workers=workers).verify(path)
+        except zipfile.BadZipFile as e:
+            click.echo('{}: not a readable archive: {}'.format(path, e))
+            quit(1)
+        for name, error in stats['corrupt']:
+            click.echo('corrupt: {}: {}'.format(name, error))
+        click.echo('{}: {} members, {} corrupt, {} bytes checked in {:.0f}s, {:.1f} MB/s'.format(
+            path, stats['members'], len(stats['corrupt']), stats['bytes'], stats['seconds'], stats['mb_per_sec']))
+        if stats['corrupt']:
+            quit(1)
+
+    def _compressor(self):
+        conf = self.config.get('compression', {})
+        return StreamCompressor(level=int(conf.get('level', 3)), threads=int(conf.get('threads', 0)), limiter=self.limiter)
+
+    def _compress_backup(self, backup_name, chunk_digests=None):
+        '''Returns the SHA-256 of the backup and the path of the archive.'''
+        conf = self.config.get('compression', {})
+        stats = self._compressor().compress_file(self._backup_path(backup_name), conf['archive_dir'], chunk_digests)
+        click.echo('compressed: {}, ratio: {:.2f}, {:.1f} MB/s, {:.0f}s'.format(
+            stats['path'], stats['ratio'], stats['mb_per_sec'], stats['seconds']))
+        return stats['sha256'], stats['path']
+
+    def decompress(self, src, dst):
+        self._load_config()
+        stats = self._compressor().decompress_file(src, dst)
+        click.echo('decompressed: {}, sha256: {}, {:.1f} MB/s'.format(dst, stats['sha256'], stats['bytes_out'] / stats['seconds'] / 1024 / 1024))
+
+    def _uploader(self):
+        conf = self.config['offload']
+        if conf.get('target', 's3') == 'local':
+            target = LocalTarget(conf['dir'])
+        else:
+            target = S3Target(conf['bucket'], prefix=conf.get('prefix', ''), endpoint_url=conf.get('endpoint_url'),
+                              access_key=conf.get('access_key'), secret_key=conf.get('secret_key'), region=conf.get('region'))
+        return Uploader(target, part_size=int(conf.get('part_size', 64 * 1024 * 1024)), concurrency=int(conf.get('concurrency', 4)),
+                        limiter=self.limiter)
+
+    def _offload_backup(self, backup_name):
+        file_path = self._backup_path(backup_name)
+        conf = self.config.get('encryption', {})
+        if conf.get('enabled'):
+            # Only the encrypted copy leaves the host.
+            sidecar_path = os.path.join(conf['dir'], os.path.basename(file_path)) + '.sha256'
+            file_path = os.path.join(conf['dir'], os.path.basename(file_path)) + ENCRYPTED_SUFFIX
+        else:
+            sidecar_path = file_path + '.sha256'
+        uploader = self._uploader()
+        stats = uploader.upload(file_path)
+        uploader.upload(sidecar_path)
+        click.echo('offloaded: {}, {} bytes sent in {:.0f}s, {:.1f} MB/s'.format(
+            os.path.basename(file_path), stats['sent'], stats['seconds'], stats['mb_per_sec']))
+        return stats
+
+    def offload(self, backup_name):
+        self._load_config()
+        self._offload_backup(backup_name)
+
+    def _cipher(self):
+        conf = self.config['encryption']
+        return ChunkCipher(load_key(conf['key_file']), chunk_size=int(conf.get('chunk_size', 4 * 1024 * 1024)),
+                           workers=conf.get('workers'), limiter=self.limiter)
+
+    def _encrypt_backup(self, backup_name, src=None, chunk_digests=None):
+        '''Encrypts the backup, or src (the compressed archive) if given. Returns the SHA-256 of what was encrypted.'''
+        stats = self._cipher().encrypt_file(src or self._backup_path(backup_name), self.config['encryption']['dir'], chunk_digests)
+        click.echo('encrypted: {}, {} chunks, {:.1f} MB/s'.format(stats['path'], stats['chunks'], stats['mb_per_sec']))
+        return stats['sha256']
+
+    def decrypt(self, src, output, start_chunk, end_chunk):
+        self._load_config()
+        stats = self._cipher().decrypt_file(src, output, start_chunk, end_chunk)
+        self._logger.info('decrypted {} chunks, {} bytes in {:.1f}s'.format(stats['chunks'], stats['bytes'], stats['seconds']))
+
+    def _chunk_store(self):
+        conf = self.config.get('repository', {})
+        return ChunkStore(conf['dir'], avg_chunk_size=int(conf.get('avg_chunk_size', 4 * 1024 * 1024)),
+                          workers=conf.get('workers'), limiter=self.limiter, chunker=conf.get('chunker', 'auto'))
+
+    def _store_in_repository(self, backup_name):
+        conf = self.config['repository']
+        file_path = self._backup_path(backup_name)
+        stats = self._chunk_store().add(file_path)
+        click.echo('repository: {} chunks, {} new, {:.1f}% new data'.format(
+            stats['chunks'], stats['new_chunks'], 100.0 * stats['new_bytes'] / max(stats['size'], 1)))
+        if conf.get('remove_source'):
+            self._logger.info(f"Remove {file_path}")
+            os.remove(file_path)
+        if self.config.get('retention', {}).get('enabled'):
+            # The backup dir retention never sees repository backups, so they are pruned here.
+            self._prune_repository()
+
+    def repo_list(self):
+        self._load_config()
+        store = self._chunk_store()
+        for name in store.recipes():
+            recipe = store.recipe(name)
+            click.echo('{}\t{}\t{} chunks'.format(name, recipe['size'], len(recipe['chunks'])))
+
+    def _prune_repository(self, dry_run=False):
+        '''Applies the retention rules to the repository backups and removes the chunks nothing uses any more.'''
+        store = self._chunk_store()
+        backups = []
+        for name in store.recipes():
+            recipe = store.recipe(name)
+            backup = Backup(name)
+            backup.mtime = recipe['created']
+            backup.size = backup.data_size = recipe['size']
+            backups.append(backup)
+        backups.sort(key=lambda b: b.mtime)
+        keep = RetentionPolicy.from_config(self.config.get('retention', {})).protected(backups)
+        removed, freed = store.prune(keep, dry_run)
+        self._logger.info('Repository: pruned {} backups, freed {} bytes'.format(len(removed), freed))
+        return removed, freed
+
+    def repo_prune(self, dry_run):
+        self._load_config()
+        removed, freed = self._prune_repository(dry_run)
+        for name in removed:
+            click.echo(name)
+        click.echo('{} backups pruned, {} bytes freed'.format(len(removed), freed))
+
+    def repo_restore(self, name, output):
+        self._load_config()
+        self._chunk_store().restore(name, output)
+
+    def _write_config_exports(self, backup_name, exports):
+        '''Writes the settings/topology exports next to the backup, returns {path: sha256}.'''
+        checksums = {}
+        file_path = self._backup_path(backup_name)
+        for name, future in exports.items():
+            try:
+                data = json.dumps(future.result(), indent=2).encode()
+            except Exception as e:
+                self._logger.error('{} export failed: {}'.format(name, e))
+                continue
+            export_path = '{}.{}.json'.format(file_path, name)
+            with open(export_path, 'wb') as file:
+                file.write(data)
+            checksums[export_path] = hashlib.sha256(data).hexdigest()
+            self._logger.info('{} exported to {}'.format(name, export_path))
+        return checksums
+
+    def _write_bundle_manifest(self, backup_name, sha256sum, checksums):
+        file_path = self._backup_path(backup_name)
+        files = {os.path.basename(file_path): {'sha256': sha256sum, 'size': os.path.getsize(file_path)}}
+        for path, digest in checksums.items():
+            files[os.path.basename(path)] = {'sha256': digest, 'size': os.path.getsize(path)}
+        with open(file_path + '.bundle.json', 'w') as json_file:
+            json.dump({'backup': os.path.basename(file_path), 'files': files}, json_file, indent=2)
+
+    def _stage_backup(self, backup_name):
+        conf = self.config['staging']
+        file_path = self._backup_path(backup_name)
+        stats = Stager(strategies=conf.get('strategies'), limiter=self.limiter).stage(file_path, conf['dir'])
+        for suffix in ('.manifest.json', '.settings.json', '.topology.json', '.bundle.json'):
+            if os.path.exists(file_path + suffix):
+                shutil.copyfile(file_path + suffix, os.path.join(conf['dir'], os.path.basename(file_path) + suffix))
+        self.metrics.set('staging.strategy', stats['strategy'])
+        click.echo('staged: {} via {} in {:.1f}s, verified by {}'.format(stats['path'], stats['strategy'], stats['seconds'], stats['verified']))
+        return stats
+
+    def stage(self, backup_name):
+        self._load_config()
+        self._stage_backup(backup_name)
+
+    def _catalog(self):
+        return Catalog(self.config.get('catalog', {}).get('path', os.path.join(script_home, 'catalog.db')))
+
+    def _echo_catalog_job(self, row):
+        duration = '{:.0f}s'.format(row['duration']) if row['duration'] is not None else '-'
+        created = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['created_at'])) if row['created_at'] else '-'
+        click.echo('{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(row['id'], row['job_type'], row['status'], created, duration,
+                                                  row['backup_name'] or '-', row['file_size'] or '-'))
+
+    def _refresh_catalog(self, catalog):
+        self._login_in_tsm()
+        click.echo('synced {} jobs'.format(catalog.sync(self.tsm)))
 
     def start(self, file, add_date, wait, zabbix, zab_test, skip_verification, timeout, clean_backup_dir, override_disk_space_check):
         self._login_in_tsm()
@@ -106,32 +420,439 @@ class TableauBackupCLI:
             return 0
 
         if clean_backup_dir:
-            self._clean_backup_dir()
+            with self.metrics.phase('cleanup'):
+                self._clean_backup_dir()
+        catalog = self._catalog()
+        if self.config.get('admission', {}).get('enabled') and not override_disk_space_check:
+            # Refuse up front instead of failing hours later on a full disk.
+            if not self._admit_backup(catalog):
+                click.echo('Not enough disk space for the next backup in {}'.format(self.config['backup']['backup_dir']))
+                self._export_metrics(status=1)
+                if zabbix:
+                    self._send_to_zabbix(1)
+                quit(1)
+        retention = None
+        if self.config.get('retention', {}).get('enabled'):
+            # Pruning runs alongside the job start instead of delaying it.
+            retention = ThreadPoolExecutor(max_workers=1).submit(self._timed_retention)
         self._logger.debug('Start backup: file:{}, add_date:{}, skip_verification:{}, timeout:{}, override_disk_space_check:{}'.format(file, add_date, skip_verification, timeout, override_disk_space_check))
+        exports = {}
+        if self.config.get('backup', {}).get('export_settings', True):
+            # Settings and topology are exported while the backup job runs, not before it.
+            pool = ThreadPoolExecutor(max_workers=2)
+            exports = {'settings': pool.submit(self.tsm.export_settings), 'topology': pool.submit(self.tsm.export_topology)}
+            pool.shutdown(wait=False)
         job_id, backup_name = self.tsm.start_backup(file, add_date, skip_verification, timeout, override_disk_space_check)
+        if retention is not None:
+            try:
+                retention.result()
+            except Exception as e:
+                self._logger.error('Retention failed: {}'.format(e))
         click.echo('job id: {}'.format(job_id))
+        catalog.record_start(job_id, backup_name)
+        if not (wait or zabbix):
+            self._write_config_exports(backup_name, exports)
+            return
+        # One poll loop feeds every consumer: console output, metrics, catalog and logging.
+        poller = self._job_poller(job_id)
+        poller.subscribe('status', self._log_status)
+        poller.subscribe('done', catalog.record_job)
+        poller.subscribe('done', self.metrics.record_job)
         if wait:
-            job_status = self._poll_job(job_id)
-            if job_status == 'Failed':
-                quit(1)
-            sha256sum = self.calculate_sha256(backup_name)
-            self.write_sha256sum_to_file(backup_name+".sha256", sha256sum)
+            poller.subscribe('note', self._echo_note)
+            poller.subscribe('done', self._echo_result)
+        try:
+            failed = poller.run(deadline=time.time() + timeout)['status'] == 'Failed'
+        except Exception as e:
+            # Still export the failure below, monitoring must not miss it.
+            self._logger.error('Polling job {} failed: {}'.format(job_id, e))
+            failed = True
+        export_checksums = self._write_config_exports(backup_name, exports)
+        if wait and not failed:
+            # The rate is measured over post-processing only, not the TSM job before it.
+            window = self.limiter.window() if self.limiter is not None else nullcontext()
+            try:
+                with window:
+                    self._post_process(job_id, backup_name, export_checksums, catalog)
+            except Exception as e:
+                # The job itself succeeded, but the run still has to be reported as failed.
+                self._logger.exception('Post-backup processing of {} failed: {}'.format(backup_name, e))
+                failed = True
+            if self.limiter is not None:
+                self.metrics.set('io.mb_per_sec', round(self.limiter.effective_rate(), 3))
+                self.metrics.set('io.throttled_seconds', round(self.limiter.waited, 3))
+                self._logger.info('I/O: {:.1f} MB/s effective, {:.0f}s throttled'.format(self.limiter.effective_rate(), self.limiter.waited))
+        self._export_metrics(status=1 if failed else 0)
+        if zabbix:
+            self._send_to_zabbix(1 if failed else 0)
+        if wait and failed:
+            quit(1)
+
+    def _post_process(self, job_id, backup_name, export_checksums, catalog):
+        sha256sum = archive = chunk_digests = None
+        compression = self.config.get('compression', {}).get('enabled')
+        encryption = self.config.get('encryption', {}).get('enabled')
+        if (compression or encryption) and self.config.get('checksum', {}).get('manifest'):
+            # The stage that reads the .tsbak also feeds the manifest chunk hashes.
+            engine = self._checksum_engine()
+            chunk_digests = engine.chunk_digests()
+        if compression:
+            with self.metrics.phase('compression'):
+                sha256sum, archive = self._compress_backup(backup_name, chunk_digests)
+        if encryption:
+            # With compression on, the archive is encrypted, so the .tsbak is still read only once.
+            with self.metrics.phase('encryption'):
+                encrypted_sha256 = self._encrypt_backup(backup_name, archive, None if archive else chunk_digests)
+            if archive is None:
+                sha256sum = encrypted_sha256
+        if chunk_digests is not None:
+            file_path = self._backup_path(backup_name)
+            self._write_manifest(engine, file_path, engine.manifest_from(file_path, chunk_digests))
+        if sha256sum is None:
+            with self.metrics.phase('checksum'):
+                sha256sum = self.calculate_sha256(backup_name)
+        self.write_sha256sum_to_file(backup_name, sha256sum)
+        self._write_bundle_manifest(backup_name, sha256sum, export_checksums)
+        backup_size = os.path.getsize(self._backup_path(backup_name))
+        self.metrics.record_backup(backup_size)
+        catalog.record_file(job_id, backup_size, sha256sum)
+        if self.config.get('staging', {}).get('enabled'):
+            with self.metrics.phase('staging'):
+                self._stage_backup(backup_name)
+        if self.config.get('offload', {}).get('enabled'):
+            with self.metrics.phase('upload'):
+                self._offload_backup(backup_name)
+        # Last: with repository.remove_source the .tsbak is gone after this step.
+        if self.config.get('repository', {}).get('enabled'):
+            with self.metrics.phase('repository'):
+                self._store_in_repository(backup_name)
+
+    async def _backup_cluster(self, creds, semaphore, file, add_date, skip_verification, timeout, override_disk_space_check):
+        name = creds['name']
+        job_id = None
+        async with semaphore:
+            started = time.time()
+            try:
+                # Every request has a timeout, so a hung cluster fails on its own instead of stalling the others.
+                async with AsyncTSMApi(url=creds.get('url'), port=creds.get('port', 8850), timeout=float(creds.get('timeout', 60))) as tsm:
+                    await tsm.login(creds.get('username'), creds.get('password'))
+                    job_id, backup_name = await tsm.start_backup(file, add_date, skip_verification, timeout, override_disk_space_check)
+                    click.echo('{}: job id: {}'.format(name, job_id))
+                    poller = self._job_poller(job_id, tsm)
+                    poller.subscribe('status', self._log_status)
+                    poller.subscribe('note', lambda job, note: click.echo('{}: {}: {} - {}'.format(name, note['step'], note['status'], note['message'])))
+                    job = await poller.run_async(deadline=started + timeout)
+            except Exception as e:
+                message = str(e) or type(e).__name__
+                self._logger.error('{}: backup failed: {}'.format(name, message))
+                return {'cluster': name, 'job_id': job_id, 'status': 'Failed', 'message': message, 'seconds': time.time() - started}
+        return {'cluster': name, 'job_id': job_id, 'status': job['status'], 'message': job.get('statusMessage', ''),
+                'seconds': time.time() - started}
+
+    def start_all(self, file, add_date, zabbix, skip_verification, timeout, override_disk_space_check):
+        self._load_config()
+        if AsyncTSMApi is None:
+            raise RuntimeError('start --all requires the aiohttp package (pip install aiohttp)')
+        targets = self._tsm_targets()
+        concurrency = int(self.config.get('fanout', {}).get('concurrency', len(targets)))
+
+        async def run():
+            # Keep at most `concurrency` backups running; a finished one frees a slot.
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(self._backup_cluster(creds, semaphore, file, add_date, skip_verification, timeout,
+                                                               override_disk_space_check) for creds in targets))
+
+        results = asyncio.run(run())
+        failed = [r for r in results if r['status'] == 'Failed']
+        click.echo('------------------------')
+        for r in results:
+            click.echo('{}\t{}\t{}\t{:.0f}s\t{}'.format(r['cluster'], r['job_id'], r['status'], r['seconds'], r['message']))
+            self.metrics.set('cluster.{}.status'.format(r['cluster']), 1 if r['status'] == 'Failed' else 0)
+            self.metrics.set('cluster.{}.seconds'.format(r['cluster']), round(r['seconds'], 3))
+        click.echo('{} clusters backed up, {} failed'.format(len(results) - len(failed), len(failed)))
+        self._export_metrics(status=1 if failed else 0)
         if zabbix:
-            job_status = self._poll_job(job_id)
-            if job_status == 'Failed':
-                self._send_to_zabbix(1)
+            self._send_to_zabbix(1 if failed else 0)
+        if failed:
+            quit(1)
+
+    def _job_watcher(self, track_all=False):
+        return JobWatcher(self.tsm, interval=float(self.config.get('poll', {}).get('watch_interval', 2)), track_all=track_all)
+
+    def _tsm_cli(self):
+        conf = self.config.get('tsm_cli', {})
+        return TSMCli(conf.get('path', 'tsm'), conf.get('profile', TABLEAU_PROFILE), int(conf.get('timeout', 3600)),
+                      int(conf.get('concurrency', 4)), conf.get('password_stdin', True))
+
+    async def _cli_login(self, tsm_cli):
+        creds = self._tsm_targets()[0]
+        await tsm_cli.login(creds.get('username'), creds.get('password'))
+
+    def _cli_sites_export(self, sites, workers, timeout):
+        tsm_cli = self._tsm_cli()
+        tsm_cli.concurrency = workers
+
+        async def export(site_id):
+            started = time.time()
+            try:
+                await tsm_cli.export_site(site_id, timeout=timeout)
+            except TSMCommandError as e:
+                result = {'site': site_id, 'job_id': None, 'status': 'Failed', 'message': str(e), 'seconds': time.time() - started}
             else:
-                self._send_to_zabbix(0)
+                result = {'site': site_id, 'job_id': None, 'status': 'Succeeded', 'message': '', 'seconds': time.time() - started}
+            try:
+                await tsm_cli.unlock_site(site_id)
+            except TSMCommandError as e:
+                self._logger.error('Unlock site {} failed: {}'.format(site_id, e))
+            return result
+
+        async def run():
+            await self._cli_login(tsm_cli)
+            return await asyncio.gather(*(export(site_id) for site_id in sites))
+
+        return asyncio.run(run())
+
+    def sites_export(self, sites, all_sites, workers, zabbix, timeout):
+        if not self._keep_session:
+            self._load_config()
+        conf = self.config.get('sites_export', {})
+        if all_sites:
+            sites = conf.get('sites', [])
+        if not sites:
+            click.echo('No sites to export')
+            return
+        workers = workers or int(conf.get('workers', 4))
+        self._logger.debug('Export {} sites with {} workers'.format(len(sites), workers))
+        if conf.get('backend') == 'cli':
+            # tsm CLI fallback: each export blocks until done, so the semaphore bounds concurrency.
+            return self._report_sites_export(self._cli_sites_export(sites, workers, timeout), zabbix)
+        self._login_in_tsm()
+        pending = deque(sites)
+        running = {}
+        results = []
+        # One asyncJobs request per tick watches every running export.
+        watcher = self._job_watcher()
+
+        def launch():
+            while pending and len(running) < workers:
+                site_id = pending.popleft()
+                try:
+                    job_id = str(self.tsm.export_site(site_id, timeout=timeout))
+                except Exception as e:
+                    self._logger.error('Export site {} failed: {}'.format(site_id, e))
+                    results.append({'site': site_id, 'job_id': None, 'status': 'Failed', 'message': str(e), 'seconds': 0})
+                    self._unlock_site(site_id)
+                    continue
+                self._logger.info('Export site {}: job id {}'.format(site_id, job_id))
+                running[job_id] = (site_id, time.time())
+                watcher.track(job_id)
+
+        def done(record):
+            site_id, started = running.pop(record.id)
+            watcher.untrack(record.id)
+            # Unlock as soon as this site's export job is over, whatever its result.
+            self._unlock_site(site_id)
+            results.append({'site': site_id, 'job_id': record.id, 'status': record.status,
+                            'message': record.status_message or '', 'seconds': time.time() - started})
+            launch()
+
+        def expire():
+            # TSM ends an export at --timeout; one not seen finishing by then (asyncJobs
+            # failing, or the job missing from the list) is failed so its site is unlocked.
+            now = time.time()
+            for job_id, (site_id, started) in tuple(running.items()):
+                if now - started >= timeout:
+                    running.pop(job_id)
+                    watcher.untrack(job_id)
+                    self._logger.error('Export site {}: job {} not finished after {}s'.format(site_id, job_id, timeout))
+                    self._unlock_site(site_id)
+                    results.append({'site': site_id, 'job_id': job_id, 'status': 'Failed',
+                                    'message': 'not finished after {}s'.format(timeout), 'seconds': now - started})
+            launch()
+            return not running and not pending
+
+        watcher.subscribe('done', done)
+        launch()
+        watcher.run(until=expire)
+        self._report_sites_export(results, zabbix)
+
+    def _report_sites_export(self, results, zabbix):
+        failed = [r for r in results if r['status'] != 'Succeeded']
+        for r in results:
+            click.echo('{}\t{}\t{}\t{:.0f}s\t{}'.format(r['site'], r['job_id'], r['status'], r['seconds'], r['message']))
+        click.echo('------------------------')
+        click.echo('{} sites exported, {} failed'.format(len(results) - len(failed), len(failed)))
+        self.metrics.set('sites.exported', len(results) - len(failed))
+        self.metrics.set('sites.failed', len(failed))
+        self._export_metrics(status=1 if failed else 0)
+        if zabbix:
+            self._send_to_zabbix(1 if failed else 0, item=self.config['zabbix']['sitesexport_item'])
+        if failed:
+            quit(1)
+
+    def _unlock_site(self, site_id):
+        try:
+            self.tsm.unlock_site(site_id)
+        except Exception as e:
+            self._logger.error('Unlock site {} failed: {}'.format(site_id, e))
+
+    def tsm_command(self, command):
+        self._load_config()
+        tsm_cli = self._tsm_cli()
+
+        async def run():
+            await self._cli_login(tsm_cli)
+            if command == 'status':
+                return await tsm_cli.status()
+            return await tsm_cli.reconnect()
+
+        try:
+            asyncio.run(run())
+        except TSMCommandError as e:
+            click.echo(str(e))
+            quit(1)
+
+    def watch(self, until_idle):
+        self._login_in_tsm()
+        watcher = self._job_watcher(track_all=True)
+        watcher.subscribe('status', lambda r, old, new: click.echo('{} {}: {} -> {}'.format(r.id, r.job_type, old, new)))
+        watcher.subscribe('note', lambda r, note: click.echo('{} {}: {}: {} - {}'.format(r.id, r.job_type, note['step'], note['status'], note['message'])))
+        watcher.subscribe('done', lambda r: click.echo('{} {}: {} {}'.format(r.id, r.job_type, r.status, r.status_message or '')))
+        try:
+            watcher.run(until=(lambda: not watcher.active) if until_idle else None)
+        except KeyboardInterrupt:
+            pass
+
+    def _run_lock(self):
+        return RunLock(self.config.get('daemon', {}).get('lock', '/var/lib/tableau-backup/backup.lock'))
+
+    def locked(self, func, *args):
+        self._load_config()
+        lock = self._run_lock()
+        if not lock.acquire():
+            click.echo('Another run holds {}'.format(lock.path))
+            quit(1)
+        try:
+            return func(*args)
+        finally:
+            lock.release()
+
+    def _scheduled_backup(self):
+        conf = self.config.get('daemon', {}).get('backup', {})
+        self.metrics = Metrics()
+        if conf.get('all'):
+            return self.start_all(self.config['backup'].get('backup_prefix', 'backup'), True, conf.get('zabbix', True),
+                                  conf.get('skip_verification', False), int(conf.get('timeout', 86400)), conf.get('override_disk_space_check', False))
+        self.start(self.config['backup'].get('backup_prefix', 'backup'), True, True, conf.get('zabbix', True), False,
+                   conf.get('skip_verification', False), int(conf.get('timeout', 86400)), False, conf.get('override_disk_space_check', False))
+
+    def _scheduled_sites_export(self):
+        self.metrics = Metrics()
+        self.sites_export([], True, None, self.config.get('sites_export', {}).get('zabbix', True), int(self.config.get('sites_export', {}).get('timeout', 86400)))
+
+    def _scheduled_retention(self):
+        self._apply_retention()
+
+    def _schedule(self, scheduler):
+        scheduler.clear()
+        jobs = ((self.config.get('backup', {}).get('backuptime'), 'backup', self._scheduled_backup),
+                (self.config.get('sites_export', {}).get('schedule'), 'sites-export', self._scheduled_sites_export),
+                (self.config.get('retention', {}).get('schedule'), 'retention', self._scheduled_retention))
+        for expression, name, func in jobs:
+            if expression:
+                scheduler.add(name, expression, func)
+
+    def _run_scheduled(self, job):
+        lock = self._run_lock()
+        if not lock.acquire():
+            self._logger.error('Skip {}: another run holds {}'.format(job['name'], lock.path))
+            return
+        self._logger.info('Run {}'.format(job['name']))
+        try:
+            self._login_in_tsm()
+            job['func']()
+        except SystemExit as e:
+            self._logger.error('{} exited with {}'.format(job['name'], e.code))
+        except Exception as e:
+            self._logger.error('{} failed: {}'.format(job['name'], e))
+            self.tsm = None
+            self._session_expires = 0
+        finally:
+            lock.release()
+        self._logger.info('{} done, next run at {}'.format(job['name'], job['next_run']))
+
+    def _on_sighup(self, signum, frame):
+        self._reload = True
 
+    def daemon(self):
+        self._load_config()
+        self._keep_session = True
+        scheduler = Scheduler()
+        self._schedule(scheduler)
+        signal.signal(signal.SIGHUP, self._on_sighup)
+        while True:
+            if self._reload:
+                self._reload = False
+                self._logger.info('SIGHUP: reload config')
+                try:
+                    self._load_config()
+                except Exception as e:
+                    self._logger.error('Keep the old config: {}'.format(e))
+                else:
+                    self.tsm = None
+                    self._schedule(scheduler)
+            for job in scheduler.due():
+                self._run_scheduled(job)
+            if time.time() >= self._session_expires:
+                try:
+                    self._login_in_tsm()
+                    self._login_failures = 0
+                except Exception as e:
+                    # Back off instead of retrying every second while TSM is down.
+                    self._login_failures += 1
+                    daemon_conf = self.config.get('daemon', {})
+                    delay = min(float(daemon_conf.get('login_backoff', 5)) * 2 ** min(self._login_failures - 1, 16),
+                                float(daemon_conf.get('login_backoff_max', 300)))
+                    self.tsm = None
+                    self._session_expires = time.time() + delay
+                    self._logger.error('TSM login failed: {}, retry in {:.0f}s'.format(e, delay))
+            wait = scheduler.seconds_until_next()
+            time.sleep(min(wait if wait is not None else 60, 60, max(1, self._session_expires - time.time())))
 
-    def list_jobs(self):
-        click.echo('coming soon...')
+    def list_jobs(self, refresh, limit):
+        self._load_config()
+        catalog = self._catalog()
+        if refresh:
+            self._refresh_catalog(catalog)
+        for row in catalog.jobs(limit=limit):
+            self._echo_catalog_job(row)
 
-    def get_job(self,id):
-        click.echo('coming soon...')
+    def get_job(self, id, refresh):
+        self._load_config()
+        catalog = self._catalog()
+        if refresh:
+            self._refresh_catalog(catalog)
+        row = catalog.job(id)
+        if row is None:
+            click.echo('job {} is not in the catalog, try --refresh'.format(id))
+            quit(1)
+        self._echo_catalog_job(row)
+        for step in catalog.steps(id):
+            duration = '{:.0f}s'.format(step['duration']) if step['duration'] is not None else '-'
+            click.echo('  {}: {} - {} ({})'.format(step['step'], step['status'], step['message'], duration))
+        if row['sha256']:
+            click.echo('sha256: {}'.format(row['sha256']))
 
-    def reconnect(self):
-        click.echo('coming soon...')
+    def latest(self, refresh):
+        self._load_config()
+        catalog = self._catalog()
+        if refresh:
+            self._refresh_catalog(catalog)
+        row = catalog.latest()
+        if row is None:
+            click.echo('no backups in the catalog, try --refresh')
+            quit(1)
+        self.get_job(row['id'], False)
 
 @click.group()
 @click.option('--config_path', default=config_path)
@@ -145,34 +866,149 @@ def cli(ctx, config_path, debug):
 @click.option('--file', help='Name of backup file.', default='backup', show_default=True)
 @click.option('--date', help='Appends the current date to the backup file name.', is_flag=True, default=True, show_default=True)
 @click.option('--wait', help='Wait for end job.', is_flag=True, default=False, show_default=True)
-@click.option('--zabbix', help='Wait and send job result to Zabbix.', is_flag=True, default=True, show_default=True)
+@click.option('--zabbix/--no-zabbix', help='Wait and send job result to Zabbix.', default=True, show_default=True)
 @click.option('--zab_test', help='Send to Zabbix 1 without run job.', is_flag=True, default=False, show_default=True)
 @click.option('--skip_verification', help='Do not verify integrity of the database backup.', is_flag=True, default=False, show_default=True)
 @click.option('--timeout', help='Seconds to wait for command to finish', type=int, default=86400, show_default=True)
 @click.option('--override_disk_space_check', help='Attempt to generate backup, despite low disk space warning.', is_flag=True, default=False, show_default=True)
 @click.option('--clean_backup_dir', help='Remove all files in backup dir', is_flag=True, default=False, show_default=True)
+@click.option('--all', 'all_clusters', help='Back up every cluster in the tsm section concurrently and wait.', is_flag=True, default=False, show_default=True)
 @click.pass_obj
-def start(tbcli, file, date, wait, zabbix, zab_test, skip_verification, timeout, clean_backup_dir, override_disk_space_check):
+def start(tbcli, file, date, wait, zabbix, zab_test, skip_verification, timeout, clean_backup_dir, override_disk_space_check, all_clusters):
     '''Start a backup'''
-    tbcli.start(file, date, wait, zabbix, zab_test, skip_verification, timeout, clean_backup_dir, override_disk_space_check)
+    if all_clusters:
+        return tbcli.locked(tbcli.start_all, file, date, zabbix, skip_verification, timeout, override_disk_space_check)
+    tbcli.locked(tbcli.start, file, date, wait, zabbix, zab_test, skip_verification, timeout, clean_backup_dir, override_disk_space_check)
 
 @cli.command()
+@click.option('--refresh', help='Sync the catalog from TSM first.', is_flag=True, default=False, show_default=True)
+@click.option('--limit', help='Number of jobs to show.', type=int, default=50, show_default=True)
 @click.pass_obj
-def list(tbcli):
+def list(tbcli, refresh, limit):
     '''Get a list of TSM backup jobs.'''
-    tbcli.list_jobs()
+    tbcli.list_jobs(refresh, limit)
 
 @cli.command()
+@click.argument('id')
+@click.option('--refresh', help='Sync the catalog from TSM first.', is_flag=True, default=False, show_default=True)
 @click.pass_obj
-def job(tbcli, id):
+def job(tbcli, id, refresh):
     '''Get the state of a previously started backup job.'''
-    tbcli.get_job(id)
+    tbcli.get_job(id, refresh)
 
 @cli.command()
+@click.option('--refresh', help='Sync the catalog from TSM first.', is_flag=True, default=False, show_default=True)
 @click.pass_obj
-def latest(tbcli):
+def latest(tbcli, refresh):
     '''Get the state of the last backup job'''
-    tbcli.reconnect()
+    tbcli.latest(refresh)
+
+@cli.command()
+@click.argument('manifest')
+@click.option('--workers', help='Number of hashing processes.', type=int, default=None)
+@click.pass_obj
+def verify(tbcli, manifest, workers):
+    '''Verify a backup against its chunked SHA-256 manifest.'''
+    tbcli.verify(manifest, workers)
+
+@cli.command('repo-list')
+@click.pass_obj
+def repo_list(tbcli):
+    '''List backups stored in the deduplicating repository.'''
+    tbcli.repo_list()
+
+@cli.command('repo-prune')
+@click.option('--dry-run', 'dry_run', help='Only show what would be removed.', is_flag=True, default=False, show_default=True)
+@click.pass_obj
+def repo_prune(tbcli, dry_run):
+    '''Apply the retention policy to the repository and remove unused chunks.'''
+    tbcli.locked(tbcli.repo_prune, dry_run)
+
+@cli.command('repo-restore')
+@click.argument('name')
+@click.option('--output', help='File to write the backup to.', type=click.File('wb'), default='-', show_default=True)
+@click.pass_obj
+def repo_restore(tbcli, name, output):
+    '''Rebuild a backup from the repository as a stream.'''
+    tbcli.repo_restore(name, output)
+
+@cli.command()
+@click.argument('src')
+@click.argument('dst')
+@click.pass_obj
+def decompress(tbcli, src, dst):
+    '''Decompress an archived backup and check its sha256.'''
+    tbcli.decompress(src, dst)
+
+@cli.command('sites-export')
+@click.option('--site', 'sites', help='Site id to export, can be repeated.', multiple=True)
+@click.option('--all', 'all_sites', help='Export every site listed in sites_export.sites.', is_flag=True, default=False, show_default=True)
+@click.option('--workers', help='Number of concurrent exports.', type=int, default=None)
+@click.option('--zabbix/--no-zabbix', help='Send the aggregated result to Zabbix.', default=True, show_default=True)
+@click.option('--timeout', help='Seconds to wait for each export to finish', type=int, default=86400, show_default=True)
+@click.pass_obj
+def sites_export(tbcli, sites, all_sites, workers, zabbix, timeout):
+    '''Export sites concurrently and unlock each one when its export is done.'''
+    tbcli.sites_export(sites, all_sites, workers, zabbix, timeout)
+
+@cli.command()
+@click.option('--dry-run', 'dry_run', help='Only show what would be removed.', is_flag=True, default=False, show_default=True)
+@click.pass_obj
+def prune(tbcli, dry_run):
+    '''Apply the retention policy to the backup dir.'''
+    tbcli.prune(dry_run)
+
+@cli.command()
+@click.argument('backup_name')
+@click.pass_obj
+def offload(tbcli, backup_name):
+    '''Upload a backup and its sha256, resuming an interrupted upload.'''
+    tbcli.offload(backup_name)
+
+@cli.command()
+@click.pass_obj
+def daemon(tbcli):
+    '''Run backups, site exports and retention on their cron schedules.'''
+    tbcli.daemon()
+
+@cli.command('verify-archive')
+@click.argument('path')
+@click.option('--workers', help='Number of verifying processes.', type=int, default=None)
+@click.pass_obj
+def verify_archive(tbcli, path, workers):
+    '''Check the member CRCs of a .tsbak without extracting it.'''
+    tbcli.verify_archive(path, workers)
+
+@cli.command('tsm')
+@click.argument('command', type=click.Choice(['status', 'reconnect']))
+@click.pass_obj
+def tsm(tbcli, command):
+    '''Run "tsm status -v" or "tsm jobs reconnect" through the tsm CLI.'''
+    tbcli.tsm_command(command)
+
+@cli.command()
+@click.option('--until-idle', 'until_idle', help='Exit when no job is running.', is_flag=True, default=False, show_default=True)
+@click.pass_obj
+def watch(tbcli, until_idle):
+    '''Tail all active TSM jobs live.'''
+    tbcli.watch(until_idle)
+
+@cli.command()
+@click.argument('backup_name')
+@click.pass_obj
+def stage(tbcli, backup_name):
+    '''Copy a backup to staging.dir with reflink, hardlink or kernel-side copy.'''
+    tbcli.stage(backup_name)
+
+@cli.command()
+@click.argument('src')
+@click.option('--output', help='File to write the plaintext to.', type=click.File('wb'), default='-', show_default=True)
+@click.option('--start-chunk', 'start_chunk', help='First chunk to decrypt.', type=int, default=0, show_default=True)
+@click.option('--end-chunk', 'end_chunk', help='Chunk to stop before, default is the end.', type=int, default=None)
+@click.pass_obj
+def decrypt(tbcli, src, output, start_chunk, end_chunk):
+    '''Decrypt and authenticate an encrypted backup or a chunk range of it.'''
+    tbcli.decrypt(src, output, start_chunk, end_chunk)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+'''Benchmark suite for backup-cli against the mock TSM server.
+
+    python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --only checksum --sizes 64,512
+'''
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_home = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, repo_home)
+cli_path = os.path.join(repo_home, 'backup-cli.py')
+
+
+def bench_cli_startup(args, tmp_dir):
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, cli_path, '--help'], check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return {'median_seconds': statistics.median(timings), 'min_seconds': min(timings), 'runs': len(timings)}
+
+
+def bench_polling(args, tmp_dir):
+    from TSMApi import TSMApi
+    from TSMApi.mock import MockTSMServer
+    from TableauBackup.poller import JobPoller
+    server = MockTSMServer(step_seconds=args.step_seconds, latency=args.latency).start_background()
+    try:
+        tsm = TSMApi(url=server.url, port=server.port)
+        tsm.login('tadmin', 'tadmin')
+        job_id, _ = tsm.start_backup('bench', add_date=False)
+        requests_before = server.requests
+        started, cpu_started = time.perf_counter(), time.process_time()
+        JobPoller(tsm, job_id, min_interval=0.1, max_interval=args.step_seconds).run()
+        return {'wall_seconds': time.perf_counter() - started, 'cpu_seconds': time.process_time() - cpu_started,
+                'requests': server.requests - requests_before}
+    finally:
+        server.shutdown()
+
+
+def bench_checksum(args, tmp_dir):
+    from TableauBackup.checksum import Sha256Engine
+    engine = Sha256Engine()
+    results = []
+    for size_mb in args.sizes:
+        path = os.path.join(tmp_dir, 'checksum_{}.bin'.format(size_mb))
+        with open(path, 'wb') as file:
+            for _ in range(size_mb):
+                file.write(os.urandom(1024 * 1024))
+        started = time.perf_counter()
+        engine.submit(path).result()
+        digest_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        engine.manifest(path)
+        manifest_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        engine.digest_with_manifest(path)
+        single_pass_seconds = time.perf_counter() - started
+        results.append({'size_mb': size_mb, 'digest_mb_per_sec': size_mb / digest_seconds,
+                        'manifest_mb_per_sec': size_mb / manifest_seconds,
+                        'digest_with_manifest_mb_per_sec': size_mb / single_pass_seconds})
+        os.remove(path)
+    return results
+
+
+def bench_dedup(args, tmp_dir):
+    from TableauBackup import dedup
+    from TableauBackup.dedup import ChunkStore
+    avg_size = args.avg_chunk_kb * 1024
+    data = os.urandom(args.dedup_mb * 1024 * 1024)
+    chunkers = ['gear'] + (['fastcdc'] if dedup.fastcdc_cy is not None else [])
+    results = {'size_mb': args.dedup_mb, 'avg_chunk_kb': args.avg_chunk_kb, 'chunkers': {}}
+    for chunker in chunkers:
+        # The gear scan is slow enough that a slice of the data gives a stable rate.
+        sample = data if chunker == 'fastcdc' else data[:4 * 1024 * 1024]
+        started = time.perf_counter()
+        dedup._cut_points(sample, avg_size // 4, avg_size, avg_size * 4, chunker)
+        scan_mb_per_sec = len(sample) / 1024 / 1024 / (time.perf_counter() - started)
+        path = os.path.join(tmp_dir, 'dedup_{}.bin'.format(chunker))
+        with open(path, 'wb') as file:
+            file.write(sample)
+        store = ChunkStore(os.path.join(tmp_dir, 'repo_' + chunker), avg_chunk_size=avg_size, chunker=chunker)
+        stats = store.add(path)
+        results['chunkers'][chunker] = {'scan_mb_per_sec': scan_mb_per_sec, 'add_mb_per_sec': len(sample) / 1024 / 1024 / stats['seconds'],
+                                        'chunks': stats['chunks'], 'workers': store.workers}
+    return results
+
+
+def _make_files(directory, count):
+    os.makedirs(directory)
+    now = time.time()
+    for i in range(count):
+        path = os.path.join(directory, 'backup_{:06d}'.format(i))
+        with open(path, 'wb') as file:
+            file.write(b'x' * 1024)
+        with open(path + '.sha256', 'w') as file:
+            file.write('0' * 64)
+        os.utime(path, (now - i * 3600, now - i * 3600))
+
+
+def bench_cleanup(args, tmp_dir):
+    from TableauBackup.retention import Inventory, RetentionPolicy
+    directory = os.path.join(tmp_dir, 'cleanup_legacy')
+    _make_files(directory, args.files)
+    started = time.perf_counter()
+    for file in os.listdir(directory):
+        file_path = os.path.join(directory, file)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+    legacy_seconds = time.perf_counter() - started
+    directory = os.path.join(tmp_dir, 'cleanup_retention')
+    _make_files(directory, args.files)
+    started = time.perf_counter()
+    inventory = Inventory(directory)
+    scan_seconds = time.perf_counter() - started
+    policy = RetentionPolicy(keep_last=10, daily=7, max_bytes=inventory.total // 2)
+    pruned = policy.apply(inventory, free_bytes=0)
+    return {'files': args.files * 2, 'legacy_delete_all_seconds': legacy_seconds, 'inventory_scan_seconds': scan_seconds,
+            'retention_seconds': time.perf_counter() - started, 'pruned': len(pruned)}
+
+
+def bench_start_wait(args, tmp_dir):
+    from TSMApi.mock import MockTSMServer
+    backup_dir = os.path.join(tmp_dir, 'backups')
+    os.makedirs(backup_dir)
+    server = MockTSMServer(backup_dir=backup_dir, step_seconds=args.step_seconds, latency=args.latency,
+                           backup_size=args.backup_mb * 1024 * 1024).start_background()
+    try:
+        config = {'tsm': {'username': 'tadmin', 'password': 'tadmin', 'url': server.url, 'port': server.port},
+                  'backup': {'backup_dir': backup_dir},
+                  'catalog': {'path': os.path.join(tmp_dir, 'catalog.db')},
+                  'poll': {'min_interval': 0.1, 'max_interval': args.step_seconds}}
+        config_path = os.path.join(tmp_dir, 'config.json')
+        with open(config_path, 'w') as json_file:
+            json.dump(config, json_file)
+        started = time.perf_counter()
+        subprocess.run([sys.executable, cli_path, '--config_path', config_path, 'start', '--wait', '--no-zabbix'],
+                       check=True, stdout=subprocess.DEVNULL)
+        return {'wall_seconds': time.perf_counter() - started, 'job_seconds': args.step_seconds * len(server.steps),
+                'backup_mb': args.backup_mb, 'requests': server.requests}
+    finally:
+        server.shutdown()
+
+
+BENCHMARKS = {
+    'cli_startup': bench_cli_startup,
+    'polling': bench_polling,
+    'checksum': bench_checksum,
+    'dedup': bench_dedup,
+    'cleanup': bench_cleanup,
+    'start_wait': bench_start_wait,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_home, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS), help='Run only this benchmark, can be repeated.')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', type=lambda v: [int(s) for s in v.split(',')], default=[16, 128, 512], help='Checksum file sizes in MB.')
+    parser.add_argument('--dedup-mb', type=int, default=256, help='Data size for the dedup benchmark in MB.')
+    parser.add_argument('--avg-chunk-kb', type=int, default=4096, help='Average chunk size for the dedup benchmark in KB.')
+    parser.add_argument('--files', type=int, default=5000, help='Backups to create for the cleanup benchmark.')
+    parser.add_argument('--step-seconds', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--backup-mb', type=int, default=64)
+    args = parser.parse_args()
+    results = {'commit': git_commit(), 'timestamp': time.time(), 'python': sys.version.split()[0], 'results': {}}
+    for name in args.only or BENCHMARKS:
+        tmp_dir = tempfile.mkdtemp(prefix='tbackup-bench-')
+        try:
+            results['results'][name] = BENCHMARKS[name](args, tmp_dir)
+        except Exception as e:
+            results['results'][name] = {'error': '{}: {}'.format(type(e).__name__, e)}
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        print('{}: {}'.format(name, json.dumps(results['results'][name])))
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
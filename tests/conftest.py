@@ -0,0 +1,11 @@
+import pytest
+
+from TSMApi.mock import MockTSMServer
+
+
+@pytest.fixture
+def mock_tsm(tmp_path):
+    server = MockTSMServer(port=0, backup_dir=str(tmp_path), step_seconds=0.05, backup_size=1024).start_background()
+    yield server
+    server.shutdown()
+    server.server_close()
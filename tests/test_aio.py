@@ -0,0 +1,162 @@
+import asyncio
+import socket
+import time
+
+import aiohttp
+import pytest
+
+from TSMApi.aio import AsyncTSMApi
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def client(server, **kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    return AsyncTSMApi(server.url, server.port, **kwargs)
+
+
+def record_delays(api):
+    delays = []
+    delay = api._delay
+
+    def recorded(attempt):
+        delays.append(attempt)
+        return delay(attempt)
+    api._delay = recorded
+    return delays
+
+
+def test_login_keeps_session_for_ip_host(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'tadmin')
+            return await api.get_jobs()
+    assert run(scenario()) == []
+    assert mock_tsm.hits[('POST', '/api/0.5/login')] == 1
+
+
+def test_login_with_bad_credentials_fails(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'wrong')
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        run(scenario())
+    assert e.value.status == 401
+
+
+def test_expired_session_logs_in_again(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'tadmin')
+            job_id, _ = await api.start_backup('backup', add_date=False)
+            mock_tsm.expire_sessions()
+            return job_id, await api.get_job(job_id)
+    job_id, job = run(scenario())
+    assert job['id'] == job_id
+    assert mock_tsm.hits[('POST', '/api/0.5/login')] == 2
+
+
+def test_get_retries_5xx_with_backoff(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'tadmin')
+            delays = record_delays(api)
+            mock_tsm.inject(503, 502)
+            return await api.get_jobs(), delays
+    jobs, delays = run(scenario())
+    assert jobs == []
+    assert delays == [0, 1]
+    assert mock_tsm.hits[('GET', '/api/0.5/asyncJobs')] == 3
+
+
+def test_get_retries_connection_reset(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'tadmin')
+            delays = record_delays(api)
+            # aiohttp itself resends a GET once when a kept-alive connection drops.
+            mock_tsm.inject('reset', 'reset')
+            return await api.get_jobs(), delays
+    jobs, delays = run(scenario())
+    assert jobs == []
+    assert delays == [0]
+    assert mock_tsm.hits[('GET', '/api/0.5/asyncJobs')] == 3
+
+
+def test_get_gives_up_after_retries(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm, retries=2) as api:
+            await api.login('tadmin', 'tadmin')
+            mock_tsm.inject(503, 503, 503)
+            await api.get_jobs()
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        run(scenario())
+    assert e.value.status == 503
+    assert mock_tsm.hits[('GET', '/api/0.5/asyncJobs')] == 3
+
+
+def test_start_backup_is_not_retried_after_reset(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'tadmin')
+            mock_tsm.inject('reset')
+            await api.start_backup('backup', add_date=False)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        run(scenario())
+    assert mock_tsm.hits[('POST', '/api/0.5/backupFixedFile')] == 1
+    assert not mock_tsm.jobs
+
+
+def test_start_backup_is_not_retried_after_5xx(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm) as api:
+            await api.login('tadmin', 'tadmin')
+            mock_tsm.inject(503)
+            await api.start_backup('backup', add_date=False)
+    with pytest.raises(aiohttp.ClientResponseError):
+        run(scenario())
+    assert mock_tsm.hits[('POST', '/api/0.5/backupFixedFile')] == 1
+
+
+def test_start_backup_is_retried_when_connect_fails():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    api = AsyncTSMApi('http://127.0.0.1', port, retries=2, backoff=0.01)
+    delays = record_delays(api)
+
+    async def scenario():
+        try:
+            await api.start_backup('backup', add_date=False)
+        finally:
+            await api.close()
+    with pytest.raises(aiohttp.ClientConnectorError):
+        run(scenario())
+    assert delays == [0, 1]
+
+
+def test_timeout(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm, timeout=0.2, retries=1) as api:
+            await api.login('tadmin', 'tadmin')
+            mock_tsm.latency = 0.5
+            await api.get_jobs()
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        run(scenario())
+    assert time.monotonic() - started < 2
+    assert mock_tsm.hits[('GET', '/api/0.5/asyncJobs')] == 2
+
+
+def test_pool_limits_concurrent_requests(mock_tsm):
+    async def scenario():
+        async with client(mock_tsm, pool_size=2) as api:
+            await api.login('tadmin', 'tadmin')
+            mock_tsm.latency = 0.1
+            mock_tsm.max_in_flight = 0
+            return await asyncio.gather(*(api.get_jobs() for _ in range(6)))
+    assert run(scenario()) == [[]] * 6
+    assert mock_tsm.max_in_flight == 2
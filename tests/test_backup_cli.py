@@ -0,0 +1,123 @@
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'backup-cli.py')
+
+
+@pytest.fixture
+def config(tmp_path, mock_tsm):
+    conf = {'tsm': {'username': 'tadmin', 'password': 'tadmin', 'url': mock_tsm.url, 'port': mock_tsm.port},
+            'backup': {'backup_dir': mock_tsm.backup_dir},
+            'catalog': {'path': str(tmp_path / 'catalog.db')},
+            'poll': {'min_interval': 0.05, 'max_interval': 0.1},
+            'daemon': {'lock': str(tmp_path / 'backup.lock')},
+            'metrics': {'json': str(tmp_path / 'metrics.jsonl')},
+            'checksum': {'manifest': True, 'workers': 1},
+            'repository': {'enabled': True, 'dir': str(tmp_path / 'repo'), 'avg_chunk_size': 1024, 'workers': 1,
+                           'chunker': 'gear'}}
+    return conf
+
+
+def run_cli(tmp_path, conf, *args):
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps(conf))
+    return subprocess.run([sys.executable, CLI, '--config_path', str(config_path)] + list(args),
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_start_wait_post_processes_the_backup(tmp_path, config):
+    result = run_cli(tmp_path, config, 'start', '--wait', '--no-zabbix', '--file', 'nightly')
+    assert result.returncode == 0, result.stdout + result.stderr
+    [backup] = [path for path in glob.glob(os.path.join(config['backup']['backup_dir'], 'nightly_*')) if '.' not in os.path.basename(path)]
+    with open(backup, 'rb') as file:
+        data = file.read()
+    with open(backup + '.sha256') as file:
+        assert file.read().split()[0] == hashlib.sha256(data).hexdigest()
+    assert os.path.exists(backup + '.bundle.json')
+    assert os.path.exists(backup + '.manifest.json')
+    recipe = json.loads((tmp_path / 'repo' / 'recipes' / (os.path.basename(backup) + '.json')).read_text())
+    assert recipe['chunker'] == 'gear'
+    metrics = json.loads((tmp_path / 'metrics.jsonl').read_text().splitlines()[-1])
+    assert metrics['status'] == 0
+
+    result = run_cli(tmp_path, config, 'verify', backup + '.manifest.json')
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_start_wait_encrypts_the_compressed_archive(tmp_path, config):
+    pytest.importorskip('zstandard')
+    pytest.importorskip('cryptography')
+    key_path = tmp_path / 'backup.key'
+    key_path.write_bytes(os.urandom(32))
+    config.pop('repository')
+    config['compression'] = {'enabled': True, 'archive_dir': str(tmp_path / 'archive')}
+    config['encryption'] = {'enabled': True, 'key_file': str(key_path), 'dir': str(tmp_path / 'encrypted'), 'chunk_size': 256}
+    result = run_cli(tmp_path, config, 'start', '--wait', '--no-zabbix', '--file', 'nightly')
+    assert result.returncode == 0, result.stdout + result.stderr
+    [backup] = [path for path in glob.glob(os.path.join(config['backup']['backup_dir'], 'nightly_*')) if '.' not in os.path.basename(path)]
+    name = os.path.basename(backup)
+    assert sorted(os.listdir(tmp_path / 'encrypted')) == [name + '.zst.enc', name + '.zst.sha256']
+    with open(backup, 'rb') as file, open(backup + '.sha256') as sidecar:
+        assert sidecar.read().split()[0] == hashlib.sha256(file.read()).hexdigest()
+    # The manifest comes from the compression pass.
+    result = run_cli(tmp_path, config, 'verify', backup + '.manifest.json')
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    decrypted = tmp_path / 'decrypted.zst'
+    result = run_cli(tmp_path, config, 'decrypt', str(tmp_path / 'encrypted' / (name + '.zst.enc')), '--output', str(decrypted))
+    assert result.returncode == 0, result.stdout + result.stderr
+    result = run_cli(tmp_path, config, 'decompress', str(decrypted), str(tmp_path / 'restored'))
+    assert result.returncode == 0, result.stdout + result.stderr
+    with open(backup, 'rb') as file:
+        assert (tmp_path / 'restored').read_bytes() == file.read()
+
+
+def test_sites_export_gives_up_at_the_timeout(tmp_path, config, mock_tsm):
+    mock_tsm.steps = ['Export site'] * 1000
+    config['poll']['watch_interval'] = 0.1
+    result = run_cli(tmp_path, config, 'sites-export', '--site', 'a', '--site', 'b', '--workers', '1', '--timeout', '1', '--no-zabbix')
+    assert result.returncode == 1, result.stdout + result.stderr
+    assert '0 sites exported, 2 failed' in result.stdout
+    assert mock_tsm.hits[('POST', '/api/0.5/sites/a/unlock')] == 1
+    assert mock_tsm.hits[('POST', '/api/0.5/sites/b/unlock')] == 1
+
+
+def test_sites_export_gives_up_when_async_jobs_keeps_failing(tmp_path, config, mock_tsm):
+    config['poll']['watch_interval'] = 0.1
+    # login, export, then every asyncJobs poll fails
+    mock_tsm.inject(*([None, None] + [500] * 100))
+    result = run_cli(tmp_path, config, 'sites-export', '--site', 'a', '--timeout', '1', '--no-zabbix')
+    assert result.returncode == 1, result.stdout + result.stderr
+    assert mock_tsm.hits[('POST', '/api/0.5/sites/a/unlock')] == 1
+
+
+def test_retention_prunes_the_repository(tmp_path, config):
+    sys.path.insert(0, os.path.dirname(CLI))
+    from TableauBackup.dedup import ChunkStore
+    store = ChunkStore(config['repository']['dir'], avg_chunk_size=1024, chunker='gear')
+    for created, name in enumerate(('old_backup', 'older_backup')[::-1]):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(64 * 1024))
+        store.add(str(path))
+        recipe = store.recipe(name)
+        recipe['created'] = created
+        (tmp_path / 'repo' / 'recipes' / (name + '.json')).write_text(json.dumps(recipe))
+    config['retention'] = {'enabled': True, 'keep_last': 1}
+
+    result = run_cli(tmp_path, config, 'repo-prune', '--dry-run')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.splitlines()[0] == 'older_backup'
+    assert store.recipes() == ['old_backup', 'older_backup']
+
+    result = run_cli(tmp_path, config, 'start', '--wait', '--no-zabbix', '--file', 'nightly')
+    assert result.returncode == 0, result.stdout + result.stderr
+    [name] = store.recipes()
+    assert name.startswith('nightly_')
+    referenced = {digest for digest, _ in store.recipe(name)['chunks']}
+    assert {entry for prefix in os.listdir(store.chunks_dir) for entry in os.listdir(os.path.join(store.chunks_dir, prefix))} == referenced
@@ -0,0 +1,73 @@
+import pytest
+
+from TableauBackup.capacity import AdmissionControl, SizeForecast
+from TableauBackup.metrics import Metrics
+from TableauBackup.retention import Inventory, RetentionPolicy
+
+DAY = 86400
+
+
+def test_forecast_follows_the_trend():
+    forecast = SizeForecast([(0, 100), (DAY, 200), (2 * DAY, 300)])
+    assert forecast.growth_per_day() == pytest.approx(100)
+    assert forecast.predict(at=3 * DAY) == 400
+
+
+def test_forecast_never_goes_below_the_latest_backup():
+    forecast = SizeForecast([(0, 300), (DAY, 200), (2 * DAY, 100)])
+    assert forecast.predict(at=10 * DAY) == 100
+
+
+def test_forecast_window_and_edge_cases():
+    assert SizeForecast([]).predict() == 0
+    assert SizeForecast([(0, 50)]).growth_per_day() == 0.0
+    assert SizeForecast([(5, 50), (5, 70)]).growth_per_day() == 0.0
+    # Only the last two samples are used: a flat 1000 after an old spike.
+    assert SizeForecast([(0, 10), (DAY, 1000), (2 * DAY, 1000)], window=2).predict(at=3 * DAY) == 1000
+
+
+def admission(tmp_path, monkeypatch, mode, free):
+    control = AdmissionControl(str(tmp_path), mode=mode, margin=0.1, min_margin_bytes=50)
+    monkeypatch.setattr(control, 'free_bytes', lambda: free[0])
+    return control
+
+
+def test_default_mode_is_refuse(tmp_path):
+    assert AdmissionControl.from_config(str(tmp_path), {}).mode == 'refuse'
+
+
+def test_required_bytes_uses_the_larger_margin(tmp_path):
+    control = AdmissionControl(str(tmp_path), margin=0.1, min_margin_bytes=50)
+    assert control.required_bytes(100) == 150
+    assert control.required_bytes(1000) == 1100
+
+
+@pytest.mark.parametrize('mode, admitted', [('refuse', False), ('proceed', True), ('prune', False)])
+def test_admit_without_space(tmp_path, monkeypatch, mode, admitted):
+    metrics = Metrics()
+    control = admission(tmp_path, monkeypatch, mode, [100])
+    assert control.admit(1000, metrics=metrics) is admitted
+    assert metrics.values['admission.required_bytes'] == 1100
+    assert metrics.values['admission.headroom_bytes'] == -1000
+
+
+def test_prune_mode_frees_space_with_the_policy(tmp_path, monkeypatch):
+    for name in ('old', 'new'):
+        (tmp_path / name).write_bytes(b'x' * 10)
+    free = [100]
+    control = admission(tmp_path, monkeypatch, 'prune', free)
+
+    class Policy(RetentionPolicy):
+        def apply(self, inventory, required_bytes=0, free_bytes=None, dry_run=False):
+            free[0] += 2000
+            return super().apply(inventory, required_bytes, free_bytes, dry_run)
+
+    assert control.admit(1000, Policy(keep_last=1), Inventory(str(tmp_path)))
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_admit_with_space_prunes_nothing(tmp_path, monkeypatch):
+    (tmp_path / 'old').write_bytes(b'x')
+    control = admission(tmp_path, monkeypatch, 'prune', [10 ** 9])
+    assert control.admit(1000, RetentionPolicy(keep_last=0), Inventory(str(tmp_path)))
+    assert (tmp_path / 'old').exists()
@@ -0,0 +1,58 @@
+from TableauBackup.catalog import Catalog
+
+
+class FakeTSM:
+    '''Serves get_jobs summaries and get_job details, counting detail fetches.'''
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.fetched = []
+
+    def get_jobs(self):
+        return [{key: value for key, value in job.items() if key != 'detailedProgress'} for job in self.jobs]
+
+    def get_job(self, job_id):
+        self.fetched.append(job_id)
+        return next(job for job in self.jobs if job['id'] == job_id)
+
+
+def job(job_id, status, notes=()):
+    return {'id': job_id, 'jobType': 'BackupFixedFileJob', 'status': status, 'statusMessage': '',
+            'createdAt': 1700000000000, 'completedAt': 1700000060000,
+            'detailedProgress': {'progressNotes': [{'step': step, 'status': 'Succeeded', 'message': '', 'timestamp': timestamp}
+                                                   for step, timestamp in notes]}}
+
+
+def test_record_job_keeps_local_fields_and_step_durations(tmp_path):
+    catalog = Catalog(str(tmp_path / 'catalog.db'))
+    catalog.record_start('1', 'nightly_2023-11-14')
+    catalog.record_file('1', 1024, 'ab' * 32)
+    catalog.record_job(job('1', 'Succeeded', [('prepare', 1700000010000), ('backup', 1700000050000)]))
+    row = catalog.job('1')
+    assert (row['backup_name'], row['file_size'], row['status']) == ('nightly_2023-11-14', 1024, 'Succeeded')
+    assert (row['created_at'], row['duration']) == (1700000000, 60)
+    assert [(step['step'], step['duration']) for step in catalog.steps('1')] == [('prepare', 10), ('backup', 40)]
+
+
+def test_running_jobs_have_no_completion():
+    catalog = Catalog(':memory:')
+    catalog.record_job(job('1', 'Running'))
+    assert (catalog.job('1')['completed_at'], catalog.job('1')['duration']) == (None, None)
+
+
+def test_sync_skips_finished_jobs():
+    tsm = FakeTSM([job('1', 'Succeeded'), job('2', 'Running')])
+    catalog = Catalog(':memory:')
+    assert catalog.sync(tsm) == 2
+    assert tsm.fetched == ['1', '2']
+
+    tsm.jobs[1] = job('2', 'Failed', [('backup', 1700000030000)])
+    tsm.jobs.append(job('3', 'Running'))
+    assert catalog.sync(tsm) == 2
+    assert tsm.fetched == ['1', '2', '2', '3']
+    assert catalog.job('2')['status'] == 'Failed'
+    assert len(catalog.steps('2')) == 1
+
+    assert catalog.sync(tsm) == 1
+    assert tsm.fetched[-1] == '3'
+    assert catalog.final_ids() == {'1', '2'}
@@ -0,0 +1,57 @@
+import hashlib
+import os
+
+import pytest
+
+from TableauBackup.checksum import ChunkDigests, Sha256Engine
+from TableauBackup.throttle import TokenBucket
+
+KB = 1024
+
+
+@pytest.mark.parametrize('size', [0, 1, 64 * KB, 64 * KB + 1, 5 * 64 * KB - 3])
+def test_single_pass_matches_separate_passes(tmp_path, size):
+    path = tmp_path / 'backup.tsbak'
+    data = os.urandom(size)
+    path.write_bytes(data)
+    engine = Sha256Engine(block_size=16 * KB, chunk_size=64 * KB, workers=2)
+    sha256sum, manifest = engine.digest_with_manifest(str(path))
+    assert sha256sum == hashlib.sha256(data).hexdigest()
+    assert manifest == engine.manifest(str(path))
+    assert engine.file_digest(str(path)) == sha256sum
+
+
+def test_single_pass_reads_the_file_once(tmp_path):
+    path = tmp_path / 'backup.tsbak'
+    path.write_bytes(os.urandom(300 * KB))
+    bucket = TokenBucket()
+    engine = Sha256Engine(block_size=16 * KB, chunk_size=64 * KB, limiter=bucket)
+    with bucket.window():
+        engine.digest_with_manifest(str(path))
+    assert bucket.consumed == 300 * KB
+
+
+def test_verify_manifest_finds_corrupt_chunk(tmp_path):
+    path = tmp_path / 'backup.tsbak'
+    path.write_bytes(os.urandom(200 * KB))
+    engine = Sha256Engine(block_size=16 * KB, chunk_size=64 * KB, workers=2)
+    _, manifest = engine.digest_with_manifest(str(path))
+    manifest_path = engine.write_manifest(str(path), manifest)
+    assert engine.verify_manifest(manifest_path) == []
+    with open(path, 'r+b') as file:
+        file.seek(130 * KB)
+        file.write(b'corrupt')
+    assert engine.verify_manifest(manifest_path) == [2]
+
+
+@pytest.mark.parametrize('piece', [1000, 64 * KB, 100 * KB])
+def test_manifest_from_another_pass(tmp_path, piece):
+    path = tmp_path / 'backup.tsbak'
+    data = os.urandom(5 * 64 * KB - 3)
+    path.write_bytes(data)
+    engine = Sha256Engine(block_size=16 * KB, chunk_size=64 * KB, workers=1)
+    digests = engine.chunk_digests()
+    assert isinstance(digests, ChunkDigests)
+    for offset in range(0, len(data), piece):
+        digests.update(data[offset:offset + piece])
+    assert engine.manifest_from(str(path), digests) == engine.manifest(str(path))
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import textwrap
+import time
+
+import pytest
+
+from TSMApi.cli import TSMCli, TSMCommandError, load_profile_env
+
+FAKE_TSM = '''\
+#!{python}
+import json, os, subprocess, sys, time
+args = sys.argv[1:]
+with open(os.path.join(os.environ['FAKE_TSM_DIR'], 'argv.log'), 'a') as log:
+    log.write(json.dumps(sys.argv) + '\\n')
+if args[0] == 'login':
+    password = sys.stdin.readline().rstrip('\\n')
+    if password != 'secret':
+        print('Invalid password', file=sys.stderr)
+        sys.exit(1)
+    print('Successfully logged in as ' + args[2])
+elif args[0] == 'lines':
+    for i in range(3):
+        print('out {{}}'.format(i), flush=True)
+        print('err {{}}'.format(i), file=sys.stderr, flush=True)
+elif args[0] == 'sleep':
+    time.sleep(float(args[1]))
+    print('slept')
+elif args[0] == 'spawn':
+    child = subprocess.Popen(['sleep', '30'])
+    with open(os.path.join(os.environ['FAKE_TSM_DIR'], 'child.pid'), 'w') as file:
+        file.write(str(child.pid))
+    print('spawned', flush=True)
+    time.sleep(30)
+elif args[0] == 'fail':
+    print('working')
+    print('Site not found', file=sys.stderr)
+    sys.exit(3)
+'''
+
+
+@pytest.fixture
+def fake_tsm(tmp_path):
+    path = tmp_path / 'tsm'
+    path.write_text(FAKE_TSM.format(python=sys.executable))
+    path.chmod(0o755)
+    profile = tmp_path / 'tableau_server.sh'
+    profile.write_text('export FAKE_TSM_DIR="{}"  # set by the installer\n'.format(tmp_path))
+    return TSMCli(str(path), profile=str(profile), timeout=10)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def argv_log(tsm_cli):
+    with open(os.path.join(tsm_cli.env['FAKE_TSM_DIR'], 'argv.log')) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_profile_env(tmp_path):
+    profile = tmp_path / 'tableau_server.sh'
+    profile.write_text(textwrap.dedent('''\
+        # Tableau Server environment
+        export TABLEAU_SERVER_DATA_DIR="/var/opt/tableau"
+        PATH=$PATH:/opt/tableau/packages/customer-bin
+        not a variable line
+    '''))
+    env = load_profile_env(str(profile), base={'PATH': '/usr/bin'})
+    assert env['TABLEAU_SERVER_DATA_DIR'] == '/var/opt/tableau'
+    assert env['PATH'] == '/usr/bin:/opt/tableau/packages/customer-bin'
+
+
+def test_output_is_captured_line_by_line(fake_tsm, caplog):
+    with caplog.at_level(logging.INFO, logger='tableau_backup.TSMCli'):
+        returncode, output = run(fake_tsm.run('lines'))
+    assert returncode == 0
+    assert sorted(output) == ['err 0', 'err 1', 'err 2', 'out 0', 'out 1', 'out 2']
+    records = {r.getMessage(): r.levelno for r in caplog.records}
+    assert records['out 1'] == logging.INFO
+    assert records['err 1'] == logging.ERROR
+
+
+def test_nonzero_exit_raises(fake_tsm):
+    with pytest.raises(TSMCommandError) as e:
+        run(fake_tsm.run('fail'))
+    assert e.value.returncode == 3
+    assert sorted(e.value.output) == ['Site not found', 'working']
+    assert 'Site not found' in str(e.value)
+
+
+def test_nonzero_exit_without_check(fake_tsm):
+    returncode, _ = run(fake_tsm.run('fail', check=False))
+    assert returncode == 3
+
+
+def test_commands_run_concurrently(fake_tsm):
+    started = time.monotonic()
+    results = run(fake_tsm.run_many([('sleep', '0.5')] * 4))
+    assert [r[0] for r in results] == [0] * 4
+    assert time.monotonic() - started < 1.5
+
+
+def test_concurrency_limit(fake_tsm):
+    fake_tsm.concurrency = 1
+    started = time.monotonic()
+    run(fake_tsm.run_many([('sleep', '0.3')] * 3))
+    assert time.monotonic() - started >= 0.9
+
+
+def test_run_many_returns_failures(fake_tsm):
+    results = run(fake_tsm.run_many([('sleep', '0'), ('fail',)]))
+    assert results[0][0] == 0
+    assert isinstance(results[1], TSMCommandError)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        with open('/proc/{}/stat'.format(pid)) as file:
+            return file.read().split(')')[-1].split()[0] != 'Z'
+    except OSError:
+        return False
+
+
+def test_timeout_kills_process_group(fake_tsm):
+    started = time.monotonic()
+    with pytest.raises(TSMCommandError) as e:
+        run(fake_tsm.run('spawn', timeout=0.5))
+    assert time.monotonic() - started < 3
+    assert e.value.returncode is None
+    assert 'spawned' in e.value.output
+    with open(os.path.join(fake_tsm.env['FAKE_TSM_DIR'], 'child.pid')) as file:
+        child = int(file.read())
+    deadline = time.monotonic() + 2
+    while _alive(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(child)
+
+
+def test_login_keeps_password_out_of_argv_and_logs(fake_tsm, caplog):
+    with caplog.at_level(logging.DEBUG, logger='tableau_backup.TSMCli'):
+        returncode, output = run(fake_tsm.login('admin', 'secret'))
+    assert returncode == 0
+    assert output == ['Successfully logged in as admin']
+    assert argv_log(fake_tsm)[0][1:] == ['login', '-u', 'admin']
+    assert not any('secret' in r.getMessage() for r in caplog.records)
+
+
+def test_login_failure(fake_tsm):
+    with pytest.raises(TSMCommandError) as e:
+        run(fake_tsm.login('admin', 'wrong'))
+    assert e.value.returncode == 1
+    assert 'wrong' not in str(e.value)
+
+
+def test_password_on_argv_is_redacted(fake_tsm, caplog):
+    fake_tsm.password_stdin = False
+    with caplog.at_level(logging.DEBUG, logger='tableau_backup.TSMCli'):
+        with pytest.raises(TSMCommandError) as e:
+            run(fake_tsm.login('admin', 'secret'))
+    assert argv_log(fake_tsm)[0][1:] == ['login', '-u', 'admin', '-p', 'secret']
+    assert e.value.argv[-1] == '***'
+    assert not any('secret' in r.getMessage() for r in caplog.records)
@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip('cryptography')
+
+from cryptography.exceptions import InvalidTag  # noqa: E402
+
+from TableauBackup.crypto import ENCRYPTED_SUFFIX, HEADER, TAG_SIZE, ChunkCipher, load_key  # noqa: E402
+
+KB = 1024
+KEY = bytes(range(32))
+
+
+def encrypt(tmp_path, data, chunk_size=4 * KB):
+    src = tmp_path / 'backup.tsbak'
+    src.write_bytes(data)
+    cipher = ChunkCipher(KEY, chunk_size=chunk_size, workers=2)
+    stats = cipher.encrypt_file(str(src), str(tmp_path / 'enc'))
+    return cipher, stats
+
+
+@pytest.mark.parametrize('size', [0, 1, 4 * KB, 4 * KB + 1, 10 * KB + 7])
+def test_round_trip(tmp_path, size):
+    data = os.urandom(size)
+    cipher, stats = encrypt(tmp_path, data)
+    assert stats['path'].endswith(ENCRYPTED_SUFFIX)
+    out = io.BytesIO()
+    result = cipher.decrypt_file(stats['path'], out)
+    assert out.getvalue() == data
+    assert result['sha256'] == stats['sha256']
+
+
+def test_chunk_range(tmp_path):
+    data = os.urandom(14 * KB + 7)
+    cipher, stats = encrypt(tmp_path, data)
+    out = io.BytesIO()
+    assert cipher.decrypt_file(stats['path'], out, 1, 3)['chunks'] == 2
+    assert out.getvalue() == data[4 * KB:12 * KB]
+    out = io.BytesIO()
+    cipher.decrypt_file(stats['path'], out, 3)
+    assert out.getvalue() == data[12 * KB:]
+    with pytest.raises(ValueError):
+        cipher.decrypt_file(stats['path'], io.BytesIO(), 4)
+
+
+def test_tampered_chunk_is_rejected(tmp_path):
+    cipher, stats = encrypt(tmp_path, os.urandom(10 * KB))
+    with open(stats['path'], 'r+b') as file:
+        file.seek(HEADER.size + 4 * KB + TAG_SIZE + 10)
+        byte = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte[0] ^ 1]))
+    with pytest.raises(InvalidTag):
+        cipher.decrypt_file(stats['path'], io.BytesIO())
+    # Chunks before the damaged one still decrypt on their own.
+    cipher.decrypt_file(stats['path'], io.BytesIO(), 0, 1)
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    cipher, stats = encrypt(tmp_path, os.urandom(10 * KB))
+    with open(stats['path'], 'r+b') as file:
+        file.truncate(HEADER.size + 2 * (4 * KB + TAG_SIZE))
+    with pytest.raises(InvalidTag):
+        cipher.decrypt_file(stats['path'], io.BytesIO())
+
+
+def test_wrong_key_is_rejected(tmp_path):
+    _, stats = encrypt(tmp_path, os.urandom(5 * KB))
+    with pytest.raises(InvalidTag):
+        ChunkCipher(bytes(32), chunk_size=4 * KB).decrypt_file(stats['path'], io.BytesIO())
+
+
+@pytest.mark.parametrize('content', [b'\n' + os.urandom(30) + b' ', KEY.hex().encode() + b'\n', KEY.hex().encode()])
+def test_load_key(tmp_path, content):
+    path = tmp_path / 'backup.key'
+    path.write_bytes(content)
+    assert load_key(str(path)) == (content if len(content) == 32 else KEY)
+
+
+def test_load_key_rejects_other_sizes(tmp_path):
+    path = tmp_path / 'backup.key'
+    path.write_bytes(os.urandom(31))
+    with pytest.raises(ValueError):
+        load_key(str(path))
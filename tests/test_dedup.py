@@ -0,0 +1,85 @@
+import io
+import os
+import random
+
+import pytest
+
+from TableauBackup import dedup
+from TableauBackup.dedup import ChunkStore
+
+KB = 1024
+
+CHUNKERS = ['gear', pytest.param('fastcdc', marks=pytest.mark.skipif(dedup.fastcdc_cy is None, reason='fastcdc not installed'))]
+
+
+@pytest.mark.parametrize('chunker', CHUNKERS)
+def test_cut_points_respect_size_limits(chunker):
+    data = os.urandom(256 * KB)
+    cuts = dedup._cut_points(data, 1 * KB, 4 * KB, 16 * KB, chunker)
+    assert cuts[-1] == len(data)
+    sizes = [end - start for start, end in zip([0] + cuts, cuts)]
+    assert all(size <= 16 * KB for size in sizes)
+    assert all(size >= 1 * KB for size in sizes[:-1])
+
+
+@pytest.mark.parametrize('chunker', CHUNKERS)
+@pytest.mark.parametrize('segment_size', [64 * KB, 1024 * KB])
+def test_add_restore_and_dedup(tmp_path, chunker, segment_size):
+    store = ChunkStore(str(tmp_path / 'repo'), avg_chunk_size=4 * KB, segment_size=segment_size, workers=2, chunker=chunker)
+    # Seeded: with unlucky data a content-defined insertion can ripple over a few more chunks.
+    data = random.Random(0).randbytes(1024 * KB)
+    first = tmp_path / 'first.tsbak'
+    first.write_bytes(data)
+    second = tmp_path / 'second.tsbak'
+    second.write_bytes(data[:500 * KB] + b'changed' + data[500 * KB:])
+    store.add(str(first))
+    stats = store.add(str(second))
+    # A small insertion only rewrites the chunks around it, whatever the segment edges are.
+    assert stats['new_chunks'] <= 2
+    assert stats['new_bytes'] <= 4 * 4 * KB
+    assert store.recipe('second.tsbak')['chunker'] == chunker
+    for path in (first, second):
+        out = io.BytesIO()
+        store.restore(path.name, out)
+        assert out.getvalue() == path.read_bytes()
+
+
+@pytest.mark.parametrize('chunker', CHUNKERS)
+def test_segments_do_not_change_chunks(tmp_path, chunker):
+    data = tmp_path / 'data.tsbak'
+    data.write_bytes(os.urandom(512 * KB))
+    whole = ChunkStore(str(tmp_path / 'whole'), avg_chunk_size=4 * KB, segment_size=1024 * KB, workers=1, chunker=chunker)
+    split = ChunkStore(str(tmp_path / 'split'), avg_chunk_size=4 * KB, segment_size=32 * KB, workers=4, chunker=chunker)
+    whole.add(str(data))
+    split.add(str(data))
+    assert split.recipe('data.tsbak')['chunks'] == whole.recipe('data.tsbak')['chunks']
+
+
+def chunk_files(store):
+    return {entry for prefix in os.listdir(store.chunks_dir) for entry in os.listdir(os.path.join(store.chunks_dir, prefix))}
+
+
+def test_prune_removes_unused_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path / 'repo'), avg_chunk_size=4 * KB, chunker='gear')
+    shared = os.urandom(64 * KB)
+    for name in ('old.tsbak', 'new.tsbak'):
+        (tmp_path / name).write_bytes(shared + os.urandom(64 * KB))
+        store.add(str(tmp_path / name))
+    before = chunk_files(store)
+    assert store.prune({'new.tsbak'}, dry_run=True) == (['old.tsbak'], 0)
+    assert chunk_files(store) == before
+    removed, freed = store.prune({'new.tsbak'})
+    assert removed == ['old.tsbak']
+    assert 0 < freed <= 64 * KB + 16 * KB
+    assert store.recipes() == ['new.tsbak']
+    assert chunk_files(store) == {chunk[0] for chunk in store.recipe('new.tsbak')['chunks']}
+    out = io.BytesIO()
+    store.restore('new.tsbak', out)
+    assert out.getvalue() == (tmp_path / 'new.tsbak').read_bytes()
+
+
+def test_auto_falls_back_to_gear(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, 'fastcdc_cy', None)
+    assert ChunkStore(str(tmp_path / 'repo'), avg_chunk_size=4 * KB).chunker == 'gear'
+    with pytest.raises(RuntimeError):
+        ChunkStore(str(tmp_path / 'repo'), avg_chunk_size=4 * KB, chunker='fastcdc')
@@ -0,0 +1,39 @@
+import logging
+from logging.handlers import QueueHandler
+
+from TableauBackup.logs import LOGGER_NAME, LogPipeline
+
+
+def _teardown(pipeline):
+    pipeline.stop()
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    logging.getLogger(LOGGER_NAME).setLevel(logging.NOTSET)
+
+
+def test_debug_is_limited_to_package_loggers():
+    pipeline = LogPipeline(debug=True)
+    try:
+        assert logging.getLogger('tableau_backup.TSMApi').isEnabledFor(logging.DEBUG)
+        assert logging.getLogger('tableau_backup.Sha256Engine').isEnabledFor(logging.DEBUG)
+        assert not logging.getLogger('botocore').isEnabledFor(logging.DEBUG)
+        assert not logging.getLogger('aiohttp.client').isEnabledFor(logging.DEBUG)
+    finally:
+        _teardown(pipeline)
+
+
+def test_configure_file_closes_the_replaced_handler(tmp_path):
+    pipeline = LogPipeline()
+    try:
+        pipeline.configure_file({'file': str(tmp_path / 'first.log')})
+        old = pipeline.handlers[-1]
+        pipeline.configure_file({'file': str(tmp_path / 'second.log')})
+        assert old.stream is None
+        assert old not in pipeline.handlers
+        logging.getLogger('tableau_backup.TableauBackupCLI').warning('to the second file')
+        pipeline.stop()
+        assert 'to the second file' in (tmp_path / 'second.log').read_text()
+        assert (tmp_path / 'first.log').read_text() == ''
+    finally:
+        _teardown(pipeline)
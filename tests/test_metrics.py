@@ -0,0 +1,31 @@
+import re
+
+from TableauBackup.metrics import JsonSink, Metrics, PrometheusSink
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*"\})? -?[0-9.e+-]+$')
+
+
+def test_prometheus_textfile_is_numeric(tmp_path):
+    metrics = Metrics()
+    metrics.set('backup.size', 1024)
+    metrics.set('io.mb_per_sec', 12.5)
+    metrics.set('staging.strategy', 'hardlink')
+    metrics.set('odd.label', 'a "quoted"\\value')
+    metrics.set('skipped.value', None)
+    path = tmp_path / 'tableau_backup.prom'
+    PrometheusSink(str(path)).send(metrics, status=0)
+    lines = path.read_text().splitlines()
+    assert all(SAMPLE.match(line) for line in lines), lines
+    assert 'tableau_backup_staging_strategy{strategy="hardlink"} 1' in lines
+    assert 'tableau_backup_odd_label{label="a \\"quoted\\"\\\\value"} 1' in lines
+    assert 'tableau_backup_backup_size 1024' in lines
+    assert 'tableau_backup_status 0' in lines
+    assert not any(line.startswith('tableau_backup_skipped') for line in lines)
+
+
+def test_json_sink_keeps_strings(tmp_path):
+    metrics = Metrics()
+    metrics.set('staging.strategy', 'reflink')
+    path = tmp_path / 'metrics.jsonl'
+    JsonSink(str(path)).send(metrics, status=1)
+    assert '"staging.strategy": "reflink"' in path.read_text()
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from TableauBackup.offload import STATE_SUFFIX, LocalTarget, S3Target, Uploader
+
+MB = 1024 * 1024
+
+
+class FlakyTarget:
+    '''Wraps a target, records the parts sent and fails the ones listed in `fail`.'''
+
+    def __init__(self, target, fail=()):
+        self.target = target
+        self.fail = set(fail)
+        self.sent = []
+
+    def create(self, key, size):
+        return self.target.create(key, size)
+
+    def upload_part(self, key, upload_id, number, offset, data):
+        if number in self.fail:
+            raise ConnectionError('connection reset while sending part {}'.format(number))
+        self.sent.append(number)
+        return self.target.upload_part(key, upload_id, number, offset, data)
+
+    def complete(self, key, upload_id, parts):
+        self.target.complete(key, upload_id, parts)
+
+    def put(self, key, data):
+        self.target.put(key, data)
+
+
+def make_source(tmp_path, size):
+    path = tmp_path / 'backup.tsbak'
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return str(path), data
+
+
+def interrupt_and_resume(target, path, part_size, parts):
+    flaky = FlakyTarget(target, fail={3})
+    with pytest.raises(ConnectionError):
+        Uploader(flaky, part_size=part_size, concurrency=1).upload(path)
+    assert os.path.exists(path + STATE_SUFFIX)
+    assert sorted(flaky.sent) == [n for n in range(1, parts + 1) if n != 3]
+
+    resumed = FlakyTarget(target)
+    stats = Uploader(resumed, part_size=part_size, concurrency=2).upload(path)
+    # Only the part that failed goes over the wire again.
+    assert resumed.sent == [3]
+    assert stats['sent'] == part_size
+    assert not os.path.exists(path + STATE_SUFFIX)
+
+
+def test_local_upload_resumes_after_interruption(tmp_path):
+    part_size = 64 * 1024
+    path, data = make_source(tmp_path, 5 * part_size - 100)
+    target = LocalTarget(str(tmp_path / 'offsite'))
+    interrupt_and_resume(target, path, part_size, 5)
+    assert (tmp_path / 'offsite' / 'backup.tsbak').read_bytes() == data
+
+
+def test_stale_state_starts_over(tmp_path):
+    part_size = 64 * 1024
+    path, _ = make_source(tmp_path, 3 * part_size)
+    target = LocalTarget(str(tmp_path / 'offsite'))
+    with pytest.raises(ConnectionError):
+        Uploader(FlakyTarget(target, fail={2}), part_size=part_size, concurrency=1).upload(path)
+    # A new backup with the same name must not reuse the old parts.
+    data = os.urandom(3 * part_size)
+    with open(path, 'wb') as file:
+        file.write(data)
+    os.utime(path, (1, 1))
+    resumed = FlakyTarget(target)
+    Uploader(resumed, part_size=part_size).upload(path)
+    assert sorted(resumed.sent) == [1, 2, 3]
+    assert (tmp_path / 'offsite' / 'backup.tsbak').read_bytes() == data
+
+
+def test_small_file_is_put_in_one_request(tmp_path):
+    path, data = make_source(tmp_path, 1000)
+    target = FlakyTarget(LocalTarget(str(tmp_path / 'offsite')))
+    stats = Uploader(target, part_size=64 * 1024).upload(path)
+    assert target.sent == []
+    assert stats['sent'] == 1000
+    assert (tmp_path / 'offsite' / 'backup.tsbak').read_bytes() == data
+
+
+def test_s3_upload_resumes_after_interruption(tmp_path):
+    moto = pytest.importorskip('moto')
+    # S3 rejects multipart parts below 5 MiB except the last one.
+    part_size = 5 * MB
+    path, data = make_source(tmp_path, 4 * part_size + 1000)
+    with moto.mock_aws():
+        target = S3Target('tableau-backups', prefix='prod/', access_key='testing', secret_key='testing', region='us-east-1')
+        target.client.create_bucket(Bucket='tableau-backups')
+        interrupt_and_resume(target, path, part_size, 5)
+        body = target.client.get_object(Bucket='tableau-backups', Key='prod/backup.tsbak')['Body'].read()
+        assert body == data
+        assert target.client.list_multipart_uploads(Bucket='tableau-backups').get('Uploads', []) == []
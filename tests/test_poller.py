@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from TableauBackup.poller import JobPoller
+
+
+class FakeTSM:
+    '''Returns queued job snapshots from get_job; an Exception in the queue is raised instead.'''
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get_job(self, job_id):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def job(status='Running', notes=0):
+    return {'id': '1', 'status': status, 'statusMessage': '',
+            'detailedProgress': {'progressNotes': [{'step': str(i), 'status': 'done', 'message': ''} for i in range(notes)]}}
+
+
+def test_poll_errors_are_retried_until_the_deadline():
+    tsm = FakeTSM(ConnectionError('reset'), job(), OSError('timeout'), job('Succeeded'))
+    poller = JobPoller(tsm, '1', min_interval=0.01, max_interval=0.01)
+    assert poller.run(deadline=time.time() + 10)['status'] == 'Succeeded'
+    assert tsm.calls == 4
+
+
+def test_poll_errors_past_the_deadline_are_raised():
+    tsm = FakeTSM(ConnectionError('reset'), ConnectionError('reset'))
+    poller = JobPoller(tsm, '1', min_interval=0.01, max_interval=0.01)
+    with pytest.raises(ConnectionError):
+        poller.run(deadline=time.time() - 1)
+    with pytest.raises(ConnectionError):
+        poller.run()
+
+
+def test_notes_are_dispatched_once_in_order():
+    poller = JobPoller(FakeTSM(), '1')
+    events = []
+    poller.subscribe('note', lambda job, note: events.append(('note', note['step'])))
+    poller.subscribe('status', lambda job, old, new: events.append(('status', old, new)))
+    poller.subscribe('done', lambda job: events.append(('done', job['status'])))
+    assert not poller.update(job(notes=1))
+    assert not poller.update(job(notes=1))
+    assert not poller.update(job(notes=3))
+    assert poller.update(job('Succeeded', notes=3))
+    assert events == [('note', '0'), ('status', None, 'Running'), ('note', '1'), ('note', '2'),
+                      ('status', 'Running', 'Succeeded'), ('done', 'Succeeded')]
+
+
+def test_interval_backs_off_and_resets_on_progress():
+    poller = JobPoller(FakeTSM(), '1', min_interval=1, max_interval=4, backoff=2)
+    intervals = []
+    for notes in (0, 0, 0, 0, 1):
+        poller.update(job(notes=notes))
+        intervals.append(poller.interval)
+    assert intervals == [2, 4, 4, 4, 1]
+
+
+def test_interval_shortens_when_a_step_is_due(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    poller = JobPoller(FakeTSM(), '1', min_interval=1, max_interval=60, backoff=10)
+    # Steps so far took 10s each, so the next one is due 10s after the last note.
+    for notes in (1, 2):
+        now[0] += 10
+        poller.update(job(notes=notes))
+    now[0] += 7
+    poller.update(job(notes=2))
+    assert poller.interval == pytest.approx(3)
+    now[0] += 3
+    poller.update(job(notes=2))
+    assert poller.interval == 1
@@ -0,0 +1,81 @@
+import logging
+import os
+import time
+
+import pytest
+
+from TableauBackup.retention import Inventory, RetentionPolicy
+
+# 2026-03-02 is a Monday, so March 2-5 is one ISO week and Feb 27 is in the week before.
+BACKUPS = [
+    ('jan10', (2026, 1, 10, 12)),
+    ('jan31', (2026, 1, 31, 12)),
+    ('feb14', (2026, 2, 14, 12)),
+    ('feb27', (2026, 2, 27, 12)),
+    ('mar02', (2026, 3, 2, 12)),
+    ('mar03', (2026, 3, 3, 12)),
+    ('mar04a', (2026, 3, 4, 9)),
+    ('mar04b', (2026, 3, 4, 21)),
+    ('mar05', (2026, 3, 5, 12)),
+]
+
+
+@pytest.fixture
+def backup_dir(tmp_path):
+    for name, (year, month, day, hour) in BACKUPS:
+        mtime = time.mktime((year, month, day, hour, 0, 0, 0, 0, -1))
+        path = tmp_path / name
+        path.write_bytes(b'x' * 100)
+        (tmp_path / (name + '.sha256')).write_text('0' * 64)
+        os.utime(path, (mtime, mtime))
+    return tmp_path
+
+
+def names(backups):
+    return sorted(b.name for b in backups)
+
+
+def test_gfs_selection(backup_dir):
+    policy = RetentionPolicy(keep_last=1, daily=2, weekly=2, monthly=2)
+    inventory = Inventory(str(backup_dir))
+    assert policy.protected(inventory.backups) == {'mar05', 'mar04b', 'feb27'}
+
+
+def test_everything_the_rules_do_not_keep_is_pruned(backup_dir):
+    policy = RetentionPolicy(keep_last=2)
+    inventory = Inventory(str(backup_dir))
+    pruned = policy.apply(inventory, free_bytes=10 ** 12)
+    assert names(pruned) == sorted(name for name, _ in BACKUPS[:-2])
+    assert sorted(os.listdir(backup_dir)) == ['mar04b', 'mar04b.sha256', 'mar05', 'mar05.sha256']
+    assert names(inventory.backups) == ['mar04b', 'mar05']
+    assert inventory.total == 2 * (100 + 64)
+
+
+def test_byte_budget_never_removes_protected_backups(backup_dir, caplog):
+    policy = RetentionPolicy(keep_last=3, max_bytes=100)
+    inventory = Inventory(str(backup_dir))
+    with caplog.at_level(logging.WARNING, logger='tableau_backup.RetentionPolicy'):
+        pruned = policy.apply(inventory, required_bytes=100, free_bytes=10 ** 12)
+    assert len(pruned) == len(BACKUPS) - 3
+    assert names(inventory.backups) == ['mar04a', 'mar04b', 'mar05']
+    assert 'cannot free enough space' in caplog.text
+
+
+def test_orphaned_sidecars_are_pruned(backup_dir):
+    (backup_dir / 'gone.sha256').write_text('0' * 64)
+    (backup_dir / 'gone.bundle.json').write_text('{}')
+    inventory = Inventory(str(backup_dir))
+    assert names(inventory.orphans) == ['gone']
+    pruned = RetentionPolicy(keep_last=len(BACKUPS)).apply(inventory, free_bytes=10 ** 12)
+    assert names(pruned) == ['gone']
+    assert not (backup_dir / 'gone.sha256').exists()
+    assert not (backup_dir / 'gone.bundle.json').exists()
+
+
+def test_dry_run_removes_nothing(backup_dir):
+    before = sorted(os.listdir(backup_dir))
+    inventory = Inventory(str(backup_dir))
+    pruned = RetentionPolicy(keep_last=1).apply(inventory, free_bytes=10 ** 12, dry_run=True)
+    assert len(pruned) == len(BACKUPS) - 1
+    assert sorted(os.listdir(backup_dir)) == before
+    assert len(inventory.backups) == len(BACKUPS)
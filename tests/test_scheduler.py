@@ -0,0 +1,81 @@
+import datetime
+import os
+
+import pytest
+
+from TableauBackup.scheduler import CronSchedule, RunLock, Scheduler
+
+
+def at(*args):
+    return datetime.datetime(*args)
+
+
+def test_cron_steps_and_ranges():
+    schedule = CronSchedule('*/15 1-2 * * *')
+    assert schedule.minutes == {0, 15, 30, 45}
+    assert schedule.next_after(at(2024, 3, 4, 0, 50)) == at(2024, 3, 4, 1, 0)
+    assert schedule.next_after(at(2024, 3, 4, 1, 0)) == at(2024, 3, 4, 1, 15)
+    assert schedule.next_after(at(2024, 3, 4, 2, 45)) == at(2024, 3, 5, 1, 0)
+    assert CronSchedule('5/20 * * * *').minutes == {5, 25, 45}
+
+
+def test_cron_sunday_is_0_and_7():
+    # 2024-03-10 is a Sunday.
+    for expression in ('0 3 * * 0', '0 3 * * 7', '0 3 * * 5-7'):
+        assert CronSchedule(expression).next_after(at(2024, 3, 9, 4, 0)) == at(2024, 3, 10, 3, 0)
+
+
+def test_cron_day_of_month_or_day_of_week():
+    # Both restricted: the 15th or any Monday (2024-03-11).
+    schedule = CronSchedule('0 0 15 * 1')
+    assert schedule.next_after(at(2024, 3, 9)) == at(2024, 3, 11)
+    assert schedule.next_after(at(2024, 3, 11)) == at(2024, 3, 15)
+    # Only one restricted: it alone decides.
+    assert CronSchedule('0 0 15 * *').next_after(at(2024, 3, 9)) == at(2024, 3, 15)
+    assert CronSchedule('0 0 * * 1').next_after(at(2024, 3, 9)) == at(2024, 3, 11)
+
+
+def test_cron_month_rollover_and_leap_day():
+    assert CronSchedule('30 4 1 * *').next_after(at(2024, 12, 31, 23, 59)) == at(2025, 1, 1, 4, 30)
+    assert CronSchedule('0 0 29 2 *').next_after(at(2024, 3, 1)) == at(2028, 2, 29)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* * 0 * *', '* * * * 8', '5-1 * * * *'])
+def test_cron_rejects_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_that_never_matches():
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 31 2 *').next_after(at(2024, 1, 1))
+
+
+def test_scheduler_returns_due_jobs_once():
+    scheduler = Scheduler()
+    scheduler.add('backup', '0 2 * * *', None, now=at(2024, 3, 4, 1, 0))
+    scheduler.add('cleanup', '30 * * * *', None, now=at(2024, 3, 4, 1, 0))
+    assert scheduler.seconds_until_next(now=at(2024, 3, 4, 1, 0)) == 30 * 60
+    assert scheduler.due(now=at(2024, 3, 4, 1, 29)) == []
+    assert [job['name'] for job in scheduler.due(now=at(2024, 3, 4, 2, 0))] == ['backup', 'cleanup']
+    assert scheduler.due(now=at(2024, 3, 4, 2, 0)) == []
+    assert [job['next_run'] for job in scheduler.jobs] == [at(2024, 3, 5, 2, 0), at(2024, 3, 4, 2, 30)]
+
+
+def test_run_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / 'locks' / 'backup.lock')
+    with RunLock(path):
+        assert not RunLock(path).acquire()
+        with open(path) as file:
+            assert file.read() == str(os.getpid())
+    assert RunLock(path).acquire()
+
+
+def test_run_lock_does_not_follow_symlinks(tmp_path):
+    victim = tmp_path / 'victim'
+    victim.write_text('keep')
+    path = tmp_path / 'backup.lock'
+    os.symlink(victim, path)
+    with pytest.raises(OSError):
+        RunLock(str(path)).acquire()
+    assert victim.read_text() == 'keep'
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from TSMApi import TSMApi
+from TSMApi.session_cache import SessionCache
+
+LOGIN = ('POST', '/api/0.5/login')
+JOBS = ('GET', '/api/0.5/asyncJobs')
+
+
+def connect(server, cache):
+    tsm = TSMApi(url=server.url, port=server.port, session_cache=cache, timeout=5)
+    tsm.login('tadmin', 'tadmin')
+    return tsm
+
+
+def test_second_process_reuses_the_cached_session(tmp_path, mock_tsm):
+    path = str(tmp_path / 'cache' / 'session.json')
+    first = SessionCache(path)
+    connect(mock_tsm, first)
+    assert (first.hits, first.misses) == (0, 1)
+    second = SessionCache(path)
+    connect(mock_tsm, second).get_jobs()
+    assert (second.hits, second.misses) == (1, 0)
+    assert mock_tsm.hits[LOGIN] == 1
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+
+def test_expired_entry_is_a_miss(tmp_path, mock_tsm):
+    path = str(tmp_path / 'session.json')
+    connect(mock_tsm, SessionCache(path, ttl=-1))
+    cache = SessionCache(path)
+    connect(mock_tsm, cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert mock_tsm.hits[LOGIN] == 2
+
+
+def test_stale_cached_cookie_logs_in_again(tmp_path, mock_tsm):
+    path = str(tmp_path / 'session.json')
+    connect(mock_tsm, SessionCache(path))
+    mock_tsm.expire_sessions()
+    cache = SessionCache(path)
+    tsm = connect(mock_tsm, cache)
+    assert cache.hits == 1
+    assert tsm.get_jobs() is not None
+    assert mock_tsm.hits[LOGIN] == 2
+    assert mock_tsm.hits[JOBS] == 2
+    # The fresh session replaced the stale one for the next process.
+    assert SessionCache(path).load(SessionCache.key(tsm.server_url, 'tadmin')) == tsm.session.cookies.get_dict()
+
+
+def test_planted_symlinks_are_not_followed(tmp_path):
+    victim = tmp_path / 'victim'
+    victim.write_text('keep')
+    path = tmp_path / 'session.json'
+    os.symlink(victim, str(path) + '.lock')
+    cache = SessionCache(str(path))
+    with pytest.raises(OSError):
+        cache.store('key', {'cookie': 'value'})
+    os.remove(str(path) + '.lock')
+    os.symlink(victim, path)
+    cache.store('key', {'cookie': 'value'})
+    assert victim.read_text() == 'keep'
+    assert not os.path.islink(path)
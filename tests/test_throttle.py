@@ -0,0 +1,46 @@
+import threading
+import time
+
+from TableauBackup.checksum import Sha256Engine
+from TableauBackup.throttle import MB, TokenBucket
+
+
+def test_rate_is_measured_over_the_window_only():
+    bucket = TokenBucket()
+    bucket.consume(100 * MB)
+    # Idle time before the window, like a TSM job, must not dilute the rate.
+    time.sleep(0.3)
+    with bucket.window():
+        bucket.consume(10 * MB)
+        time.sleep(0.1)
+    time.sleep(0.3)
+    assert bucket.consumed == 10 * MB
+    assert 50 < bucket.effective_rate() < 110
+
+
+def test_effective_rate_without_window():
+    assert TokenBucket(10).effective_rate() == 0.0
+
+
+def test_waited_is_counted_for_every_thread():
+    bucket = TokenBucket(mb_per_sec=20, burst_mb=1)
+    with bucket.window():
+        threads = [threading.Thread(target=bucket.consume, args=(2 * MB,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # The bucket starts empty: at 20 MB/s the four 2 MB requests wait 0.1 + 0.2 + 0.3 + 0.4 s.
+    assert 0.9 < bucket.waited < 1.1
+    assert bucket.consumed == 8 * MB
+
+
+def test_worker_reads_are_recorded(tmp_path):
+    path = tmp_path / 'backup.tsbak'
+    path.write_bytes(b'x' * (3 * MB + 5))
+    bucket = TokenBucket(mb_per_sec=1000)
+    engine = Sha256Engine(block_size=MB, chunk_size=MB, workers=2, limiter=bucket)
+    with bucket.window():
+        manifest = engine.manifest(str(path))
+    assert len(manifest['chunks']) == 4
+    assert bucket.consumed == 3 * MB + 5
@@ -0,0 +1,76 @@
+from TableauBackup.watcher import JobWatcher
+
+
+class FakeTSM:
+    '''get_jobs returns the next queued job list; an Exception in the queue is raised instead.'''
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def get_jobs(self):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def job(job_id, status='Running', notes=0):
+    return {'id': job_id, 'jobType': 'BackupFixedFileJob', 'status': status, 'statusMessage': '', 'progress': 0.5,
+            'detailedProgress': {'progressNotes': [{'step': str(i)} for i in range(notes)]}}
+
+
+def subscribed(watcher):
+    events = []
+    watcher.subscribe('status', lambda record, old, new: events.append(('status', record.id, old, new)))
+    watcher.subscribe('note', lambda record, note: events.append(('note', record.id, note['step'])))
+    watcher.subscribe('done', lambda record: events.append(('done', record.id)))
+    return events
+
+
+def test_tick_dispatches_only_changes():
+    tsm = FakeTSM([job('1', notes=1), job('2')],
+                  [job('1', notes=1), job('2')],
+                  [job('1', notes=2), job('2', 'Succeeded')])
+    watcher = JobWatcher(tsm)
+    watcher.track('1')
+    watcher.track(2)
+    events = subscribed(watcher)
+    watcher.tick()
+    assert events == [('note', '1', '0'), ('status', '1', None, 'Running'), ('status', '2', None, 'Running')]
+    del events[:]
+    watcher.tick()
+    assert events == []
+    watcher.tick()
+    assert events == [('note', '1', '1'), ('status', '2', 'Running', 'Succeeded'), ('done', '2')]
+    assert watcher.pending == ['1']
+
+
+def test_untracked_jobs_are_ignored():
+    watcher = JobWatcher(FakeTSM([job('1'), job('2', 'Succeeded')]))
+    watcher.track('1')
+    events = subscribed(watcher)
+    watcher.tick()
+    assert events == [('status', '1', None, 'Running')]
+    assert set(watcher.records) == {'1'}
+
+
+def test_track_all_skips_jobs_finished_before_watching():
+    tsm = FakeTSM([job('1', 'Succeeded', notes=3), job('2', notes=1)],
+                  [job('1', 'Succeeded', notes=3), job('2', 'Failed', notes=1), job('3')])
+    watcher = JobWatcher(tsm, track_all=True)
+    events = subscribed(watcher)
+    watcher.tick()
+    assert events == [('note', '2', '0'), ('status', '2', None, 'Running')]
+    del events[:]
+    watcher.tick()
+    assert events == [('status', '2', 'Running', 'Failed'), ('done', '2'), ('status', '3', None, 'Running')]
+    assert [record.id for record in watcher.active] == ['3']
+
+
+def test_run_survives_poll_errors():
+    tsm = FakeTSM(ConnectionError('reset'), [job('1', 'Succeeded')])
+    watcher = JobWatcher(tsm, interval=0)
+    watcher.track('1')
+    watcher.run(until=lambda: not watcher.pending)
+    assert watcher.ticks == 2
+    assert watcher.records['1'].status == 'Succeeded'